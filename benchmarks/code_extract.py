@@ -0,0 +1,175 @@
+"""Check the code extractor against the regexes it replaced, and time both.
+
+The differential check runs a corpus of hand-written messages and many random ones
+through both and fails on the first difference.
+The timings show the regexes backtracking quadratically on unclosed code spans full of
+whitespace, while the extractor stays linear in the message length.
+Run from the repository root with `python -m benchmarks.code_extract`.
+"""
+
+import argparse
+import random
+import re
+import time
+from typing import Callable, List
+
+from snakeboxed.code_extract import CodeSpan, find_code_spans, strip_raw_code
+
+# the regexes prepare_input used before
+FORMATTED_CODE_REGEX = re.compile(
+    r"(?P<delim>(?P<block>```)|``?)"  # code delimiter: 1-3 backticks; (?P=block) only matches if it's a block
+    r"(?(block)(?:(?P<lang>[a-z]+)\n)?)"  # if we're in a block, match optional language (only letters plus newline)
+    r"(?:[ \t]*\n)*"  # any blank (empty or tabs/spaces only) lines before the code
+    r"(?P<code>.*?)"  # extract all code inside the markup
+    r"\s*"  # any more whitespace before the end of the code markup
+    r"(?P=delim)",  # match the exact same delimiter from the start again
+    re.DOTALL | re.IGNORECASE,  # '.' also matches newlines, case insensitive
+)
+RAW_CODE_REGEX = re.compile(
+    r"^(?:[ \t]*\n)*"  # any blank (empty or tabs/spaces only) lines before the code
+    r"(?P<code>.*?)"  # extract all the rest as code
+    r"\s*$",  # any trailing whitespace until the end of the string
+    re.DOTALL,  # '.' also matches newlines
+)
+
+CORPUS = [
+    "",
+    "print(1)",
+    "\n\n  \t\n  print(1)  \n\n",
+    "`print(1)`",
+    "``print(1)``",
+    "```print(1)```",
+    "```py\nprint(1)\n```",
+    "```PY\nprint(1)\n```",
+    "```python3\nprint(1)\n```",
+    "```py \nprint(1)\n```",
+    "```\u212a\nprint(1)\n```",
+    "```\u0130\u0131\u017f\nprint(1)\n```",
+    "```py\n\n   \n\t\nprint(1)\n\n```",
+    "```py\nprint(1)\n``` text ```py\nprint(2)\n```",
+    "`a` ```b``` `c` ```d```",
+    "``````",
+    "````",
+    "`````",
+    "```` ``",
+    "``a`",
+    "```a``",
+    "```a`",
+    "`",
+    "``",
+    "```",
+    "```py\nprint(1)",
+    "text `inline` text",
+    "`a\u2028`",
+    "```py\nprint(1)\x1c\x1f\n```",
+    "```\n```",
+    "` `",
+    "\r\n`\r\n`\r\n",
+]
+FUZZ_PIECES = [
+    "`",
+    "``",
+    "```",
+    "\n",
+    " ",
+    "\t",
+    "\r",
+    "\u2028",
+    "\x1c",
+    "a",
+    "py",
+    "PY",
+    "\u212a",
+    "\u0131",
+    "print(1)",
+    "x\n",
+    " \n",
+]
+SIZES = [10**3, 10**4, 3 * 10**4, 10**5, 10**6]
+# stop timing the regexes once one run takes longer than this, in seconds
+REGEX_TIME_LIMIT = 5
+
+
+def regex_find_code_spans(text: str) -> List[CodeSpan]:
+    return [
+        CodeSpan(*match.group("code", "delim", "lang"))
+        for match in FORMATTED_CODE_REGEX.finditer(text)
+    ]
+
+
+def regex_strip_raw_code(text: str) -> str:
+    return RAW_CODE_REGEX.fullmatch(text).group("code")
+
+
+def check(text: str):
+    assert find_code_spans(text) == regex_find_code_spans(text), repr(text)
+    assert strip_raw_code(text) == regex_strip_raw_code(text), repr(text)
+
+
+def check_corpus():
+    for text in CORPUS:
+        check(text)
+    print(f"{len(CORPUS)} corpus messages extracted the same as the regexes")
+
+
+def check_fuzz(cases: int, seed: int):
+    rng = random.Random(seed)
+    for _ in range(cases):
+        pieces = rng.choices(FUZZ_PIECES, k=rng.randint(0, 30))
+        check("".join(pieces))
+    print(f"{cases} random messages extracted the same as the regexes (seed {seed})")
+
+
+ADVERSARIAL = {
+    "unclosed inline code full of spaces": lambda n: "`" + " " * n,
+    "double backticks closed by a single one": lambda n: "``" + " " * n + "`",
+    "unclosed block with a long first line": lambda n: "```" + "a" * n,
+    "unformatted code with a long gap": lambda n: "x" + " " * n + "x",
+}
+
+
+def time_call(function: Callable, text: str) -> float:
+    start = time.perf_counter()
+    function(text)
+    return time.perf_counter() - start
+
+
+def extract(text: str):
+    if not find_code_spans(text):
+        strip_raw_code(text)
+
+
+def regex_extract(text: str):
+    if not regex_find_code_spans(text):
+        regex_strip_raw_code(text)
+
+
+def time_adversarial():
+    for name, make_text in ADVERSARIAL.items():
+        print(name)
+        print(f"{'length':>10} {'regex (s)':>10} {'extractor (s)':>14}")
+        regex_too_slow = False
+        for size in SIZES:
+            text = make_text(size)
+            if regex_too_slow:
+                regex_time = "-"
+            else:
+                regex_seconds = time_call(regex_extract, text)
+                regex_too_slow = regex_seconds > REGEX_TIME_LIMIT
+                regex_time = f"{regex_seconds:.4f}"
+            print(f"{size:>10} {regex_time:>10} {time_call(extract, text):>14.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fuzz-cases", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    check_corpus()
+    check_fuzz(args.fuzz_cases, args.seed)
+    time_adversarial()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Time loading a Sphinx inventory and looking symbols up in it, checked by brute force.
+
+Uses the objects.inv given with --inventory, or builds one from the standard library
+modules of the running interpreter so it works offline.
+Run from the repository root with `python -m benchmarks.docs_lookup`.
+"""
+
+import argparse
+import importlib
+import random
+import sys
+import time
+import tracemalloc
+import zlib
+from pathlib import Path
+from typing import List
+
+from snakeboxed.docs import MAX_FUZZY_DISTANCE, MAX_RESULTS, DocsIndex
+
+BASE_URL = "https://docs.python.org/3/"
+LOOKUPS = 1000
+
+
+def make_inventory() -> bytes:
+    """Return an objects.inv listing the public names in the standard library modules."""
+    lines = []
+    for module_name in sorted(sys.stdlib_module_names):
+        if module_name.startswith("_") or module_name in {"antigravity", "this"}:
+            continue
+        try:
+            module = importlib.import_module(module_name)
+        except Exception:
+            continue
+        page = f"library/{module_name}.html"
+        lines.append(f"{module_name} py:module 0 {page}#module-$ -")
+        for name in dir(module):
+            if name.startswith("_"):
+                continue
+            full_name = f"{module_name}.{name}"
+            lines.append(f"{full_name} py:function 1 {page}#$ -")
+            value = getattr(module, name, None)
+            if isinstance(value, type):
+                for attribute in vars(value):
+                    if not attribute.startswith("_"):
+                        lines.append(f"{full_name}.{attribute} py:method 1 {page}#$ -")
+
+    header = (
+        "# Sphinx inventory version 2\n"
+        "# Project: Python\n"
+        f"# Version: {sys.version_info.major}.{sys.version_info.minor}\n"
+        "# The remainder of this file is compressed using zlib.\n"
+    )
+    return header.encode() + zlib.compress("\n".join(lines).encode())
+
+
+def edit_distance(a: str, b: str) -> int:
+    """The textbook Levenshtein distance, without the trie's banding."""
+    row = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        new_row = [i]
+        for j, b_char in enumerate(b, 1):
+            new_row.append(
+                min(new_row[j - 1] + 1, row[j] + 1, row[j - 1] + (b_char != char))
+            )
+        row = new_row
+    return row[-1]
+
+
+def keys_of(index: DocsIndex) -> List[str]:
+    return [key for key, _ in index.trie.iter_prefix("")]
+
+
+def check(index: DocsIndex, queries: List[str]):
+    keys = keys_of(index)
+    for query in queries:
+        prefixed = sorted(key for key, _ in index.trie.iter_prefix(query))
+        assert prefixed == sorted(key for key in keys if key.startswith(query)), query
+
+        within = index.trie.search_within(query, MAX_FUZZY_DISTANCE)
+        # keys with lengths further apart than the distance can't be close enough
+        expected = {
+            key: distance
+            for key in keys
+            if abs(len(key) - len(query)) <= MAX_FUZZY_DISTANCE
+            and (distance := edit_distance(key, query)) <= MAX_FUZZY_DISTANCE
+        }
+        assert {key: distance for distance, key, _ in within} == expected, query
+
+        # the fuzzy search stops at the first distance from 1 up with any keys
+        closest = max(min(expected.values(), default=0), 1)
+        fuzzy = index.trie.search_fuzzy(query, MAX_FUZZY_DISTANCE)
+        assert {key for _, key, _ in fuzzy} == {
+            key for key, distance in expected.items() if distance <= closest
+        }, query
+    print(f"{len(queries)} prefix and fuzzy searches matched brute force")
+
+
+def time_per_call(function, queries: List[str]) -> float:
+    start = time.perf_counter()
+    for query in queries:
+        function(query)
+    return (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--inventory", type=Path, help="an objects.inv file to use")
+    parser.add_argument(
+        "--checks", type=int, default=20, help="queries to check against brute force"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data = args.inventory.read_bytes() if args.inventory else make_inventory()
+
+    start = time.perf_counter()
+    index = DocsIndex.from_inventory(data, BASE_URL)
+    load_time = time.perf_counter() - start
+    # measured on a second load, since tracing slows it down
+    tracemalloc.start()
+    second_index = DocsIndex.from_inventory(data, BASE_URL)
+    index_memory = tracemalloc.get_traced_memory()[0]
+    del second_index
+    tracemalloc.stop()
+    print(
+        f"loaded {len(index.items)} symbols as {len(index.trie)} keys "
+        f"in {load_time:.3f}s using {index_memory / 2**20:.1f}MB"
+    )
+
+    rng = random.Random(args.seed)
+    names = [item.name.casefold() for item in index.items]
+    exact = rng.choices(names, k=LOOKUPS)
+    prefixes = [name[: rng.randint(1, len(name))] for name in exact]
+    typos = []
+    for name in exact:
+        i = rng.randrange(len(name))
+        typos.append(
+            name[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + name[i + 1 :]
+        )
+
+    check(index, rng.sample(prefixes, args.checks) + rng.sample(typos, args.checks))
+
+    for kind, queries in (("exact", exact), ("prefix", prefixes), ("fuzzy", typos)):
+        # bypassing the search cache
+        per_call = time_per_call(lambda query: index.find(query, MAX_RESULTS), queries)
+        print(f"{kind:>7} search: {per_call * 1e6:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
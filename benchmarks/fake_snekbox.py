@@ -0,0 +1,118 @@
+"""A stand-in for the snekbox /eval endpoint, for benchmarking the bot without docker.
+
+Run from the repository root with `python -m benchmarks.fake_snekbox`,
+see --help for options.
+"""
+
+import argparse
+import asyncio
+import random
+from typing import Optional, Sequence
+
+from aiohttp import web
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8060
+
+
+class FakeSnekbox:
+    """Answer eval jobs after a fixed latency with generated output and return codes."""
+
+    def __init__(
+        self,
+        latency: float = 0.1,
+        output_size: int = 100,
+        returncodes: Sequence[Optional[int]] = (0,),
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+    ):
+        self.latency = latency
+        self.output_size = output_size
+        self.returncodes = list(returncodes)
+        self.host = host
+        self.port = port
+
+        self.jobs = 0
+        self.runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def make_output(self) -> str:
+        line = "The quick brown fox jumps over the lazy dog\n"
+        return (line * (self.output_size // len(line) + 1))[: self.output_size]
+
+    async def handle_eval(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        if "input" not in data and "args" not in data:
+            raise web.HTTPBadRequest()
+
+        self.jobs += 1
+        await asyncio.sleep(self.latency)
+        return web.json_response(
+            {
+                "stdout": self.make_output(),
+                "returncode": random.choice(self.returncodes),
+            }
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/eval", self.handle_eval)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+def returncode(value: str) -> Optional[int]:
+    return None if value.casefold() == "none" else int(value)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--latency", type=float, default=0.1, help="seconds taken by each job"
+    )
+    parser.add_argument(
+        "--output-size", type=int, default=100, help="characters of stdout per job"
+    )
+    parser.add_argument(
+        "--returncodes",
+        type=returncode,
+        nargs="+",
+        default=[0],
+        help="return codes to pick from at random, 'none' for a failed job",
+    )
+    return parser
+
+
+async def serve(args: argparse.Namespace):
+    fake_snekbox = FakeSnekbox(
+        latency=args.latency,
+        output_size=args.output_size,
+        returncodes=args.returncodes,
+        host=args.host,
+        port=args.port,
+    )
+    await fake_snekbox.start()
+    print(f"fake snekbox listening on {fake_snekbox.url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await fake_snekbox.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(get_parser().parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,138 @@
+"""Benchmark Snekbox.format_output against the old formatter on 1KB to 50MB outputs.
+
+Times include building the attachment for the full output; the new formatter compresses
+outputs over Discord's file size limit in a worker thread, so the event loop is blocked
+for less than the time shown.
+Also checks that both formatters give the same preview for a corpus of tricky outputs.
+Run from the repository root with `python -m benchmarks.format_output`.
+"""
+
+import asyncio
+import io
+import logging
+import time
+import tracemalloc
+
+from snakeboxed.cogs.snekbox import (
+    ESCAPE_REGEX,
+    MAX_DISCORD_FILE_LENGTH_BYTES,
+    Snekbox,
+)
+
+SIZES = [10**3, 10**4, 10**5, 10**6, 10**7, 5 * 10**7]
+CORPUS = [
+    "",
+    "\n\n\n",
+    "hello world\n",
+    "a\nb",
+    "<@123>",
+    "<!@123>",
+    "<@``",
+    "<!@``",
+    "<@`",
+    "``",
+    "```",
+    "\u202e\u200b`",
+    "line\n" * 10,
+    "line\n" * 11,
+    "line\n" * 12,
+    "x" * 999,
+    "x" * 1000,
+    "<@" * 499,
+    "<@" * 500,
+    "\n".join(["y" * 90] * 11),
+    "\n".join(["y" * 100] * 10),
+    "\n".join(["y" * 85] * 11),
+    "\n".join(["<@" * 44] * 11),
+    "a\n" * 5 + "```",
+]
+
+
+async def old_format_output(output: str):
+    """The formatter before it was made single pass.
+
+    Returns whether the output was truncated instead of uploading the full output,
+    see old_output_to_discord_file.
+    """
+    output = output.rstrip("\n")
+    if "<@" in output:
+        output = output.replace("<@", "<@\u200b")
+    if "<!@" in output:
+        output = output.replace("<!@", "<!@\u200b")
+    if ESCAPE_REGEX.findall(output):
+        return "Code block escape attempt detected; will not output result", True
+
+    truncated = False
+    lines = output.count("\n")
+    if lines > 0:
+        output = [f"{i:03d} | {line}" for i, line in enumerate(output.split("\n"), 1)]
+        output = output[:11]
+        output = "\n".join(output)
+    if lines > 10:
+        truncated = True
+        if len(output) >= 1000:
+            output = "... (truncated - too long, too many lines)"
+        else:
+            output = "... (truncated - too many lines)"
+    elif len(output) >= 1000:
+        truncated = True
+        output = "... (truncated - too long)"
+
+    return output or "[No output]", truncated
+
+
+async def old_output_to_discord_file(output: str) -> io.BytesIO:
+    output_bytes = output.encode(encoding="utf_8")
+    if len(output_bytes) > MAX_DISCORD_FILE_LENGTH_BYTES:
+        output_bytes = b"too long to upload"
+    return io.BytesIO(output_bytes)
+
+
+async def old_format_and_upload(output: str):
+    preview, truncated = await old_format_output(output)
+    if truncated:
+        await old_output_to_discord_file(output.rstrip("\n"))
+    return preview
+
+
+def make_output(size: int) -> str:
+    line = "The quick brown fox jumps over the lazy dog 0123456789\n"
+    return (line * (size // len(line) + 1))[:size]
+
+
+async def check_corpus(cog: Snekbox):
+    for output in CORPUS:
+        new_preview, discord_file = await cog.format_output(output)
+        old_preview, old_truncated = await old_format_output(output)
+        assert new_preview == old_preview, (output, new_preview, old_preview)
+        assert (discord_file is not None) == old_truncated, output
+    print(f"{len(CORPUS)} corpus outputs formatted the same as before")
+
+
+async def time_call(coro) -> float:
+    start = time.perf_counter()
+    await coro
+    return time.perf_counter() - start
+
+
+async def main():
+    cog = Snekbox.__new__(Snekbox)
+    await check_corpus(cog)
+
+    print(f"{'size':>12} {'old (s)':>10} {'new (s)':>10} {'new peak mem':>14}")
+    for size in SIZES:
+        output = make_output(size)
+        old_time = await time_call(old_format_and_upload(output))
+
+        tracemalloc.start()
+        new_time = await time_call(cog.format_output(output))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"{size:>12} {old_time:>10.4f} {new_time:>10.4f} {peak:>14}")
+
+
+if __name__ == "__main__":
+    # quieten the formatter's logging
+    logging.disable(logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,259 @@
+"""Drive the eval command with many concurrent users, without Discord or a real snekbox.
+
+Each fake user runs eval jobs one after another through Snekbox.eval_command,
+against a fake snekbox started in-process unless --snekbox-url is given.
+Reports throughput, latency and peak memory.
+Run from the repository root with `python -m benchmarks.load_test`,
+see --help for options.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import logging
+import resource
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from benchmarks.fake_snekbox import FakeSnekbox, get_parser as get_snekbox_parser
+from snakeboxed.bot import Snakeboxed
+from snakeboxed.tracing import setup_tracing
+
+_ids = itertools.count(1)
+
+
+class FakeUser:
+    def __init__(self, name: str):
+        self.id = next(_ids)
+        self.name = name
+        self.mention = f"<@{self.id}>"
+        self.voice = None
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeChannel:
+    def __init__(self, name: str):
+        self.id = next(_ids)
+        self.name = name
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeGuild:
+    def __init__(self, name: str):
+        self.id = next(_ids)
+        self.name = name
+        self.channel = FakeChannel(f"{name}-eval")
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeMessage:
+    def __init__(self, content: str = "", author: Optional[FakeUser] = None):
+        self.id = next(_ids)
+        self.content = content
+        self.author = author
+        self.attachments = []
+        self.reference = None
+
+    async def add_reaction(self, emoji: str):
+        pass
+
+    async def clear_reaction(self, emoji: str):
+        pass
+
+    async def delete(self):
+        pass
+
+    async def edit(self, **kwargs):
+        pass
+
+
+class FakeContext:
+    """Just enough of commands.Context for the eval command."""
+
+    def __init__(
+        self,
+        bot: Snakeboxed,
+        author: FakeUser,
+        guild: FakeGuild,
+        content: str,
+        send_latency: float = 0,
+    ):
+        self.bot = bot
+        self.author = author
+        self.guild = guild
+        self.channel = guild.channel
+        self.message = FakeMessage(content, author)
+        self.command = bot.get_command("eval")
+        self.send_latency = send_latency
+        self.sent: List[str] = []
+
+    def typing(self):
+        return contextlib.nullcontext()
+
+    async def send(self, content: Optional[str] = None, **kwargs) -> FakeMessage:
+        for discord_file in kwargs.get("files") or ():
+            discord_file.close()
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.sent.append(content)
+        return FakeMessage(content)
+
+    async def send_help(self, command):
+        self.sent.append(f"help for {command}")
+
+
+async def run_user(
+    bot: Snakeboxed,
+    guild: FakeGuild,
+    jobs: int,
+    send_latency: float,
+    latencies: List[float],
+    same_code: bool = False,
+) -> List[str]:
+    user = FakeUser(f"user{next(_ids)}")
+    snekbox_cog = bot.get_cog("Snekbox")
+    sent = []
+
+    for job in range(jobs):
+        code = (
+            f"```py\nprint('job {job}')\n```"
+            if same_code
+            else f"```py\nprint('{user} job {job}')\n```"
+        )
+        ctx = FakeContext(bot, user, guild, f"?eval {code}", send_latency)
+        start = time.perf_counter()
+        await snekbox_cog.eval_command.callback(snekbox_cog, ctx, code=code)
+        latencies.append(time.perf_counter() - start)
+        sent.extend(ctx.sent)
+
+    return sent
+
+
+def peak_rss_mb() -> float:
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run(args: argparse.Namespace):
+    fake_snekbox = None
+    snekbox_url = args.snekbox_url
+    if snekbox_url is None:
+        fake_snekbox = FakeSnekbox(
+            latency=args.latency,
+            output_size=args.output_size,
+            returncodes=args.returncodes,
+            host=args.host,
+            port=args.port,
+        )
+        await fake_snekbox.start()
+        snekbox_url = fake_snekbox.url
+
+    config = {
+        "settings": {"command_prefixes": ["?"], "snekbox_url": snekbox_url},
+        "scheduler": {
+            "max_concurrency": args.max_concurrency,
+            "max_queue": args.max_queue,
+        },
+        "guild_settings": {"path": ":memory:"},
+        "rate_limits": {"enabled": args.rate_limits},
+    }
+    bot = Snakeboxed(config, command_prefix="?")
+    await bot.setup_hook()
+    # nobody edits their message during a load test, and extensions are loaded as new modules
+    # rather than the one imported here
+    sys.modules[bot.get_cog("Snekbox").__module__].REEVAL_TIMEOUT = 0
+
+    guilds = [FakeGuild(f"guild{i}") for i in range(args.guilds)]
+    latencies = []
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            run_user(
+                bot,
+                guilds[i % len(guilds)],
+                args.jobs,
+                args.send_latency,
+                latencies,
+                args.same_code,
+            )
+            for i in range(args.users)
+        )
+    )
+    elapsed = time.perf_counter() - start
+
+    await bot.close()
+    if fake_snekbox is not None:
+        await fake_snekbox.close()
+
+    sent = [content for user_sent in results for content in user_sent]
+    rate_limited = sum("too often" in content for content in sent)
+    rejected = sum(":hourglass:" in content for content in sent) - rate_limited
+    queued = sum("queued at position" in content for content in sent)
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+
+    print(f"users: {args.users} jobs: {len(latencies)} in {elapsed:.2f}s")
+    print(f"throughput: {len(latencies) / elapsed:.1f} jobs/s")
+    if percentiles:
+        print(f"latency p50: {percentiles[49]:.3f}s p99: {percentiles[98]:.3f}s")
+    print(f"queued: {queued} rejected: {rejected} rate limited: {rate_limited}")
+    if fake_snekbox is not None:
+        print(f"snekbox runs: {fake_snekbox.jobs}")
+    print(f"peak RSS: {peak_rss_mb():.1f}MB")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        parents=[get_snekbox_parser()],
+        add_help=False,
+    )
+    parser.add_argument("--users", type=int, default=100, help="concurrent users")
+    parser.add_argument("--jobs", type=int, default=10, help="eval jobs per user")
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument(
+        "--send-latency",
+        type=float,
+        default=0,
+        help="seconds taken by each Discord send",
+    )
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=100)
+    parser.add_argument(
+        "--snekbox-url", help="use this snekbox server instead of a fake one"
+    )
+    parser.add_argument(
+        "--same-code",
+        action="store_true",
+        help="every user runs the same code, so identical jobs can share snekbox runs",
+    )
+    parser.add_argument(
+        "--rate-limits",
+        action="store_true",
+        help="apply the default per user, channel and guild rate limits",
+    )
+    parser.add_argument("--log", action="store_true", help="keep the bot's INFO logs")
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        help="write a trace of each job's stages to this file, for benchmarks.trace_report",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    if not args.log:
+        logging.disable(logging.INFO)
+    if args.trace is not None:
+        setup_tracing({"enabled": True}, trace_path=args.trace)
+    asyncio.run(run(args))
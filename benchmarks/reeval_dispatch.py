@@ -0,0 +1,78 @@
+"""Compare the cost of routing one message edit to re-eval sessions, as they grow.
+
+The old way registered a bot.wait_for predicate per session, and discord.py checks
+every one of them on every edit. ReevalSessions looks the session up by message id.
+Run from the repository root with `python -m benchmarks.reeval_dispatch`.
+"""
+
+import asyncio
+import time
+from functools import partial
+from types import SimpleNamespace
+
+import discord
+
+from snakeboxed.reeval import ReevalSessions
+
+SESSION_COUNTS = [10, 100, 1000, 10000]
+EVENTS = 1000
+
+
+def fake_message(message_id: int, content: str = "print(1)") -> SimpleNamespace:
+    return SimpleNamespace(id=message_id, content=content)
+
+
+def predicate_eval_message_edit(ctx, old_msg, new_msg) -> bool:
+    """The predicate the old continue_eval registered for each session."""
+    return new_msg.id == ctx.message.id and old_msg.content != new_msg.content
+
+
+async def time_wait_for(sessions: int) -> float:
+    async with discord.Client(intents=discord.Intents.none()) as client:
+        waiters = []
+        for message_id in range(sessions):
+            ctx = SimpleNamespace(message=fake_message(message_id))
+            check = partial(predicate_eval_message_edit, ctx)
+            waiters.append(
+                asyncio.create_task(client.wait_for("message_edit", check=check))
+            )
+        await asyncio.sleep(0)
+
+        # edits of a message that has no session, so every predicate runs and none match
+        before, after = fake_message(-1), fake_message(-1, "print(2)")
+        start = time.perf_counter()
+        for _ in range(EVENTS):
+            client.dispatch("message_edit", before, after)
+        elapsed = time.perf_counter() - start
+
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+
+    return elapsed / EVENTS
+
+
+async def time_registry(sessions: int) -> float:
+    reeval_sessions = ReevalSessions()
+    for message_id in range(sessions):
+        reeval_sessions.start(fake_message(message_id), author_id=message_id)
+
+    payload = SimpleNamespace(message_id=-1, data={"content": "print(2)"}, message=None)
+    start = time.perf_counter()
+    for _ in range(EVENTS):
+        reeval_sessions.dispatch_edit(payload)
+    return (time.perf_counter() - start) / EVENTS
+
+
+async def main():
+    print(f"{'sessions':>10} {'wait_for (us)':>14} {'registry (us)':>14}")
+    for sessions in SESSION_COUNTS:
+        wait_for_time = await time_wait_for(sessions)
+        registry_time = await time_registry(sessions)
+        print(
+            f"{sessions:>10} {wait_for_time * 1e6:>14.2f} {registry_time * 1e6:>14.3f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
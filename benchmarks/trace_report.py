@@ -0,0 +1,112 @@
+"""Report the latency of each stage of eval jobs from the trace file.
+
+Reads the trace file written when [tracing] is enabled and its rotated backups,
+and prints how long each kind of span took, and how much of the time spent running
+jobs it accounts for. Time spent waiting for the user to edit their message between
+re-evaluations isn't counted as running a job.
+Run from the repository root with `python -m benchmarks.trace_report [path]`.
+"""
+
+import argparse
+import json
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from snakeboxed.metrics import quantile
+from snakeboxed.tracing import DEFAULT_TRACE_PATH
+
+QUANTILES = (0.5, 0.9, 0.99)
+# the span that covers running one job, which the other stages are a share of
+JOB_SPAN = "iteration"
+
+
+def trace_files(path: Path) -> List[Path]:
+    """Return the trace file and its rotated backups, oldest first."""
+    backups = sorted(
+        (
+            backup
+            for backup in path.parent.glob(f"{path.name}.*")
+            if backup.suffix[1:].isdigit()
+        ),
+        key=lambda backup: int(backup.suffix[1:]),
+        reverse=True,
+    )
+    return backups + ([path] if path.exists() else [])
+
+
+def read_spans(paths: List[Path]) -> Iterator[dict]:
+    for path in paths:
+        with open(path, encoding="utf_8") as trace_file:
+            for line in trace_file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line can be cut off if the bot was killed while writing it
+                    continue
+
+
+def report(spans: List[dict]):
+    durations: Dict[str, List[float]] = defaultdict(list)
+    errors: Counter = Counter()
+    iterations: Counter = Counter()
+    for span in spans:
+        durations[span["name"]].append(span["duration"])
+        if span["error"] is not None:
+            errors[span["name"], span["error"]] += 1
+        if span["name"] == JOB_SPAN:
+            iterations[span["trace_id"]] += 1
+
+    job_time = sum(durations.get(JOB_SPAN, ()))
+    print(f"traces: {len({span['trace_id'] for span in spans})} spans: {len(spans)}")
+    if iterations:
+        print(
+            f"jobs: {sum(iterations.values())}, "
+            f"re-evaluated in {sum(count > 1 for count in iterations.values())} traces, "
+            f"at most {max(iterations.values())} times"
+        )
+    print()
+
+    header = f"{'stage':<24}{'count':>8}{'mean':>10}"
+    header += "".join(f"{f'p{q * 100:g}':>10}" for q in QUANTILES)
+    header += f"{'max':>10}{'of jobs':>10}"
+    print(header)
+    # stages that took the most time in total first
+    for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+        row = f"{name:<24}{len(values):>8}{sum(values) / len(values) * 1000:>8.1f}ms"
+        row += "".join(f"{quantile(values, q) * 1000:>8.1f}ms" for q in QUANTILES)
+        row += f"{max(values) * 1000:>8.1f}ms"
+        # spans of one job can overlap, for example the blocks of --each
+        if job_time and name != "eval" and name != "wait_for_reeval":
+            row += f"{100 * sum(values) / job_time:>9.1f}%"
+        print(row)
+
+    if errors:
+        print()
+        print("errors:")
+        for (name, error), count in errors.most_common():
+            print(f"  {name}: {error} x{count}")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "path",
+        nargs="?",
+        type=Path,
+        default=DEFAULT_TRACE_PATH,
+        help="the trace file, its rotated backups next to it are read too",
+    )
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    paths = trace_files(args.path)
+    if not paths:
+        raise SystemExit(f"No trace files at {args.path}")
+    report(list(read_spans(paths)))
+
+
+if __name__ == "__main__":
+    main()
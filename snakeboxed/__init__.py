@@ -1,24 +1,23 @@
 """Simple Discord bot for snekbox (sandboxed Python code execution), self-host or use a global instance."""
 
-
+import argparse
 import logging
-import sys
 import tomllib
 from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Type
 
-from discord.ext import commands
+from snakeboxed.logs import setup_logging
+from snakeboxed.startup_profile import StartupProfile, maybe_section
+from snakeboxed.tracing import setup_tracing
 
-import snakeboxed.cogs
-from snakeboxed.bot import Snakeboxed
+# discord.py and the bot are only imported when they're needed, so importing snakeboxed stays cheap
+if TYPE_CHECKING:
+    from snakeboxed.bot import Snakeboxed
 
 # todo: make class for config
-# todo: settings system for global hosting
-#       where to allow/disallow eval: channel, user, role
-#       docs lookup sources
+# todo: more guild settings, like docs lookup sources
 # todo: python resources commands
-#       port docs lookup
 #       stackoverflow error search
-# todo: allow message links as eval input
 # todo: create privileged eval command for owner only
 # todo: docker image
 # todo: setup.py
@@ -29,18 +28,8 @@ __version__ = "1.8.0"
 
 
 CONFIG_PATH = Path("config.toml")
-LOG_PATH = Path("info.log")
-
-
-stream_handler = logging.StreamHandler(stream=sys.stdout)
-file_handler = logging.FileHandler(LOG_PATH, encoding="utf_8")
-logging.basicConfig(
-    level=logging.INFO,
-    handlers=[
-        stream_handler,
-        file_handler,
-    ],
-)
+
+
 log = logging.getLogger(__name__)
 
 
@@ -50,19 +39,63 @@ def get_config() -> dict:
     return config
 
 
-def main():
-    """Run an instance of the bot with config loaded from the toml file."""
-    config = get_config()
-    formatter = logging.Formatter(logging.BASIC_FORMAT)
+def run_bot(
+    config: dict,
+    bot_class: Optional[Type["Snakeboxed"]] = None,
+    startup_profile: Optional[StartupProfile] = None,
+    **kwargs,
+):
+    """Run an instance of the bot with the given config until it's closed.
 
-    snakeboxed_bot = snakeboxed.Snakeboxed(
-        snekbox_url=config["settings"]["snekbox_url"],
+    Logging should already be set up, discord.py's logs go through it too.
+    """
+    with maybe_section(startup_profile, "import the bot"):
+        from discord.ext import commands
+
+        from snakeboxed.bot import Snakeboxed
+
+    if bot_class is None:
+        bot_class = Snakeboxed
+    snakeboxed_bot = bot_class(
+        config,
         command_prefix=commands.when_mentioned_or(
             *config["settings"]["command_prefixes"]
         ),
+        startup_profile=startup_profile,
+        **kwargs,
+    )
+
+    snakeboxed_bot.run(config["auth"]["token"], log_handler=None)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="log the time taken by imports and each step of startup once the bot is ready",
     )
+    return parser
+
+
+def main(argv: Optional[List[str]] = None):
+    """Run an instance of the bot with config loaded from the toml file.
+
+    If sharding is enabled, run a cluster of sharded bots instead.
+    """
+    args = get_parser().parse_args(argv)
+    startup_profile = StartupProfile() if args.profile_startup else None
+
+    config = get_config()
+    setup_logging(config.get("logging", {}))
+    setup_tracing(config.get("tracing", {}))
+
+    if config.get("sharding", {}).get("enabled", False):
+        import snakeboxed.cluster
 
-    snakeboxed_bot.run(config["auth"]["token"], log_formatter=formatter)
+        snakeboxed.cluster.launch(config, startup_profile=startup_profile)
+    else:
+        run_bot(config, startup_profile=startup_profile)
 
 
 if __name__ == "__main__":
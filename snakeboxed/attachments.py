@@ -0,0 +1,215 @@
+import asyncio
+import base64
+import codecs
+import io
+import re
+import zipfile
+from pathlib import PurePosixPath
+from typing import AsyncIterator, List, NamedTuple, Optional, Tuple
+
+import aiohttp
+import discord
+
+DEFAULT_MAX_BYTES = 1_000_000
+DEFAULT_MAX_TOTAL_BYTES = 2_000_000
+DEFAULT_MAX_FILES = 20
+CHUNK_SIZE = 64 * 1024
+
+PYTHON_CONTENT_TYPE = re.compile("text/x-python(?:; charset=([a-z0-9-_]+))?")
+ZIP_CONTENT_TYPES = {"application/zip", "application/x-zip-compressed"}
+DEFAULT_ENCODING = "utf_8"
+MAIN_FILE_NAMES = ("main.py", "__main__.py")
+
+
+class AttachmentError(Exception):
+    """Raised when attachments can't be used as eval input. The message is shown to the user."""
+
+
+class EvalFile(NamedTuple):
+    path: str
+    content: str
+
+    def to_snekbox(self) -> dict:
+        """Return the file in the format of the snekbox API, which takes base64 content."""
+        content = base64.b64encode(self.content.encode("utf_8")).decode("ascii")
+        return {"path": self.path, "content": content}
+
+
+def is_python(attachment: discord.Attachment) -> bool:
+    content_type = attachment.content_type or ""
+    matches_type = PYTHON_CONTENT_TYPE.match(content_type) is not None
+    return matches_type or attachment.filename.endswith(".py")
+
+
+def is_zip(attachment: discord.Attachment) -> bool:
+    content_type = (attachment.content_type or "").split(";")[0]
+    return content_type in ZIP_CONTENT_TYPES or attachment.filename.endswith(".zip")
+
+
+def get_encoding(attachment: discord.Attachment) -> str:
+    match = PYTHON_CONTENT_TYPE.match(attachment.content_type or "")
+    if match is None or match.group(1) is None:
+        return DEFAULT_ENCODING
+    return match.group(1)
+
+
+def split_main_file(files: List[EvalFile]) -> Tuple[str, List[EvalFile]]:
+    """Return the code of the file to run and the rest of the files.
+
+    The file to run is main.py or __main__.py if there is one, otherwise the first file.
+    """
+    main_file = next(
+        (f for f in files if PurePosixPath(f.path).name in MAIN_FILE_NAMES), files[0]
+    )
+    return main_file.content, [f for f in files if f is not main_file]
+
+
+class AttachmentReader:
+    """Read Python files and zip archives of them from message attachments.
+
+    Attachments are checked against the size limits before downloading,
+    then streamed in chunks so a wrong size can't make them use more memory than the limit.
+    """
+
+    def __init__(
+        self,
+        http_session: aiohttp.ClientSession,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_total_bytes: int = DEFAULT_MAX_TOTAL_BYTES,
+        max_files: int = DEFAULT_MAX_FILES,
+    ):
+        self.http_session = http_session
+        self.max_bytes = max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_files = max_files
+
+    @classmethod
+    def from_config(
+        cls, http_session: aiohttp.ClientSession, config: dict
+    ) -> "AttachmentReader":
+        return cls(
+            http_session,
+            max_bytes=config.get("max_bytes", DEFAULT_MAX_BYTES),
+            max_total_bytes=config.get("max_total_bytes", DEFAULT_MAX_TOTAL_BYTES),
+            max_files=config.get("max_files", DEFAULT_MAX_FILES),
+        )
+
+    async def iter_chunks(self, attachment: discord.Attachment) -> AsyncIterator[bytes]:
+        if attachment.size > self.max_bytes:
+            raise AttachmentError(
+                f"{attachment.filename} is over the {self.max_bytes} byte limit."
+            )
+
+        received = 0
+        async with self.http_session.get(attachment.url, raise_for_status=True) as resp:
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                received += len(chunk)
+                if received > self.max_bytes:
+                    raise AttachmentError(
+                        f"{attachment.filename} is over the {self.max_bytes} byte limit."
+                    )
+                yield chunk
+
+    async def read_text(self, attachment: discord.Attachment) -> str:
+        encoding = get_encoding(attachment)
+        try:
+            decoder = codecs.getincrementaldecoder(encoding)()
+        except LookupError:
+            raise AttachmentError(
+                f"{attachment.filename} has an unknown encoding {encoding}."
+            )
+
+        parts = []
+        try:
+            async for chunk in self.iter_chunks(attachment):
+                parts.append(decoder.decode(chunk))
+            parts.append(decoder.decode(b"", final=True))
+        except UnicodeDecodeError:
+            raise AttachmentError(f"{attachment.filename} isn't valid {encoding} text.")
+        return "".join(parts)
+
+    async def read_zip(self, attachment: discord.Attachment) -> List[EvalFile]:
+        data = b"".join([chunk async for chunk in self.iter_chunks(attachment)])
+        # decompressing can take a while
+        return await asyncio.to_thread(self.extract_zip, attachment.filename, data)
+
+    def extract_zip(self, filename: str, data: bytes) -> List[EvalFile]:
+        """Return the Python files in a zip archive, checking the declared sizes before extracting.
+
+        Extraction stops at the declared size, so the declared sizes can be trusted.
+        """
+        try:
+            archive = zipfile.ZipFile(io.BytesIO(data))
+        except zipfile.BadZipFile:
+            raise AttachmentError(f"{filename} isn't a valid zip archive.")
+
+        with archive:
+            infos = [
+                info
+                for info in archive.infolist()
+                if not info.is_dir() and info.filename.endswith(".py")
+            ]
+            if len(infos) > self.max_files:
+                raise AttachmentError(
+                    f"{filename} has more than {self.max_files} Python files."
+                )
+            if sum(info.file_size for info in infos) > self.max_total_bytes:
+                raise AttachmentError(
+                    f"{filename} is over the {self.max_total_bytes} byte limit once extracted."
+                )
+
+            files = []
+            for info in infos:
+                path = PurePosixPath(info.filename)
+                if path.is_absolute() or ".." in path.parts:
+                    raise AttachmentError(f"{filename} has a file outside the archive.")
+                try:
+                    content = archive.read(info).decode(DEFAULT_ENCODING)
+                except UnicodeDecodeError:
+                    raise AttachmentError(
+                        f"{info.filename} in {filename} isn't valid UTF-8 text."
+                    )
+                except (zipfile.BadZipFile, NotImplementedError):
+                    raise AttachmentError(
+                        f"{info.filename} in {filename} can't be extracted."
+                    )
+                files.append(EvalFile(str(path), content))
+        return files
+
+    async def read_files(self, message: discord.Message) -> List[EvalFile]:
+        """Return all the Python files in the message's attachments, including in zip archives."""
+        attachments = [a for a in message.attachments if is_python(a) or is_zip(a)]
+        if sum(a.size for a in attachments) > self.max_total_bytes:
+            raise AttachmentError(
+                f"The attachments are over the {self.max_total_bytes} byte limit."
+            )
+
+        files = []
+        for attachment in attachments:
+            if is_python(attachment):
+                files.append(
+                    EvalFile(attachment.filename, await self.read_text(attachment))
+                )
+            else:
+                files.extend(await self.read_zip(attachment))
+            if len(files) > self.max_files:
+                raise AttachmentError(
+                    f"There are more than {self.max_files} Python files."
+                )
+
+        paths = [f.path for f in files]
+        if len(set(paths)) < len(paths):
+            raise AttachmentError("Two of the Python files have the same name.")
+        return files
+
+    async def read_code(
+        self, message: discord.Message
+    ) -> Tuple[Optional[str], List[EvalFile]]:
+        """Return the code to run from the message's attachments and any other files it needs.
+
+        Return None and no files if there are no Python attachments.
+        """
+        files = await self.read_files(message)
+        if not files:
+            return None, []
+        return split_main_file(files)
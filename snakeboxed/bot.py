@@ -1,51 +1,302 @@
+import asyncio
+import hashlib
+import importlib.util
 import logging
-from typing import Optional
+import multiprocessing.synchronize
+import time
+from functools import partial
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import aiohttp
+import discord
 from discord import Intents
 from discord.ext import commands
 
-import snakeboxed
+import snakeboxed.cogs
+from snakeboxed import metrics
+from snakeboxed.guild_settings import GuildSettings
+from snakeboxed.outbound import OutboundQueue
+from snakeboxed.perf import LoopMonitor
+from snakeboxed.snekbox_pool import SnekboxPool
+from snakeboxed.startup_profile import StartupProfile, maybe_section
 
 log = logging.getLogger(__name__)
 
+# discord allows one IDENTIFY every 5 seconds per bucket
+IDENTIFY_INTERVAL = 5
+
 INTENTS = Intents.default()
 INTENTS.message_content = True
 
+# only what the cogs use: messages and their content, re-eval reactions, and guilds for channels,
+# roles and permissions. Members come with their messages, so they don't need to be cached
+LOW_MEMORY_INTENTS = Intents(
+    guilds=True,
+    guild_messages=True,
+    dm_messages=True,
+    message_content=True,
+    guild_reactions=True,
+    dm_reactions=True,
+)
+
+
+def client_options(config: dict) -> dict:
+    """Return the intents and gateway cache options for discord.py from the [low_memory] config.
+
+    In low memory mode, events the bot doesn't handle aren't received, members aren't cached or
+    chunked, and discord.py's message cache is off, since the Snekbox cog only uses raw events
+    and its own cache of message content.
+    """
+    if not config.get("enabled", False):
+        return {"intents": INTENTS}
+    return {
+        "intents": LOW_MEMORY_INTENTS,
+        "max_messages": None,
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+    }
+
+
+class QueuedContext(commands.Context):
+    """Context that sends messages through the bot's outbound queue."""
+
+    async def send(self, *args, **kwargs) -> discord.Message:
+        return await self.bot.outbound.run(
+            self.channel.id, None, partial(super().send, *args, **kwargs)
+        )
+
 
 class Snakeboxed(commands.Bot):
     """Custom Bot class for the Snekbox cog.
 
-    Adds http_session as an attribute, which is an aiohttp.ClientSession required by the Snekbox cog.
+    Adds http_session as an attribute, which is an aiohttp.ClientSession for general use,
+    snekbox_pool, which sends eval jobs to the configured snekbox servers for the Snekbox cog,
+    guild_settings, which holds each guild's settings,
+    outbound, which paces the messages, edits and reactions the bot sends in each channel,
+    and loop_monitor, which samples event loop lag in the background.
+    Commands are invoked with a QueuedContext, so ctx.send goes through outbound.
+    The cogs are loaded as extensions, which can be reloaded in place when their source changes.
+    Extensions that aren't needed to start are loaded once the bot is ready, or on first use.
     Also uses a help command with a custom no_category.
     """
 
-    def __init__(self, snekbox_url: str, *args, **kwargs):
-        self.snekbox_url = snekbox_url
+    def __init__(
+        self,
+        config: dict,
+        *args,
+        startup_profile: Optional[StartupProfile] = None,
+        **kwargs,
+    ):
+        self.config = config
+        self.startup_profile = startup_profile
+        self.snekbox_pool = SnekboxPool.from_config(
+            config["settings"]["snekbox_url"], config.get("snekbox", {})
+        )
+        self.guild_settings = GuildSettings.from_config(
+            config.get("guild_settings", {})
+        )
+        self.outbound = OutboundQueue.from_config(config.get("outbound", {}))
+        self.loop_monitor = LoopMonitor.from_config(config.get("perf", {}))
         # assigned in on_ready for async
         self.http_session: Optional[aiohttp.ClientSession] = None
+        self.metrics_server: Optional[metrics.MetricsServer] = None
+        # hashes of the extensions' source when they were loaded, to find changed ones
+        self.extension_hashes: Dict[str, str] = {}
+        # cleared while extensions are being reloaded
+        self.extensions_ready = asyncio.Event()
+        self.lazy_extensions: List[str] = list(
+            config.get("startup", {}).get(
+                "lazy_extensions", snakeboxed.cogs.LAZY_EXTENSIONS
+            )
+        )
+        self.lazy_extensions_lock = asyncio.Lock()
 
         kwargs.setdefault(
             "help_command", commands.DefaultHelpCommand(no_category="Help")
         )
-        super().__init__(*args, **kwargs, intents=INTENTS)
+        for name, value in client_options(config.get("low_memory", {})).items():
+            kwargs.setdefault(name, value)
+        super().__init__(*args, **kwargs)
 
     async def setup_hook(self):
-        self.http_session = aiohttp.ClientSession()
+        with self.profile_section("start the HTTP session and snekbox pool"):
+            self.http_session = aiohttp.ClientSession()
+            self.snekbox_pool.start()
+        self.loop_monitor.start()
+        metrics.EVENT_LOOP_LAG_SECONDS.set_function(lambda: self.loop_monitor.last_lag)
+        with self.profile_section("load the guild settings"):
+            await self.guild_settings.open()
+
+        metrics_config = self.config.get("metrics", {})
+        if metrics_config.get("enabled", False):
+            with self.profile_section("start the metrics server"):
+                metrics.GATEWAY_LATENCY_SECONDS.set_function(lambda: self.latency)
+                self.metrics_server = metrics.MetricsServer.from_config(metrics_config)
+                await self.metrics_server.start()
 
         # add all relevant cogs
-        owner_cog = snakeboxed.cogs.Owner(self)
-        await self.add_cog(owner_cog)
-        python_info_cog = snakeboxed.cogs.PythonInfo(self)
-        await self.add_cog(python_info_cog)
-        snakeboxed_info_cog = snakeboxed.cogs.SnakeboxedInfo(self)
-        await self.add_cog(snakeboxed_info_cog)
-        snekbox_cog = snakeboxed.cogs.Snekbox(self, snekbox_url=self.snekbox_url)
-        await self.add_cog(snekbox_cog)
+        for extension in snakeboxed.cogs.EXTENSIONS:
+            if extension not in self.lazy_extensions:
+                await self.load_extension(extension)
+        self.extensions_ready.set()
+
+    def profile_section(self, name: str):
+        return maybe_section(self.startup_profile, name)
+
+    @staticmethod
+    def extension_hash(name: str) -> str:
+        source_path = Path(importlib.util.find_spec(name).origin)
+        return hashlib.sha256(source_path.read_bytes()).hexdigest()
+
+    async def load_extension(self, name: str, *, package: Optional[str] = None):
+        with self.profile_section(f"load {name}"):
+            await super().load_extension(name, package=package)
+        self.extension_hashes[name] = self.extension_hash(name)
+
+    async def load_lazy_extensions(self):
+        """Load the extensions that weren't needed to start, if they haven't been loaded yet."""
+        async with self.lazy_extensions_lock:
+            while self.lazy_extensions:
+                name = self.lazy_extensions.pop(0)
+                try:
+                    await self.load_extension(name)
+                except commands.ExtensionError:
+                    log.exception(f"Failed to load {name}")
+                else:
+                    log.info(f"Loaded {name}")
+
+    async def get_context(self, origin, /, *, cls=QueuedContext):
+        return await super().get_context(origin, cls=cls)
+
+    async def process_commands(self, message: discord.Message):
+        """Invoke the command in the message, loading the lazy extensions first
+        if it's a command they might have.
+        """
+        if message.author.bot:
+            return
+
+        ctx = await self.get_context(message)
+        if ctx.prefix is not None and ctx.command is None and self.lazy_extensions:
+            await self.load_lazy_extensions()
+            ctx = await self.get_context(message)
+        await self.invoke(ctx)
+
+    async def reload_extension(self, name: str, *, package: Optional[str] = None):
+        await super().reload_extension(name, package=package)
+        self.extension_hashes[name] = self.extension_hash(name)
+
+    def changed_extensions(self) -> List[str]:
+        """Return the loaded extensions whose source has changed since they were loaded.
+
+        Only the extension modules themselves are checked, changes to the modules they import
+        still need a restart.
+        """
+        return [
+            name
+            for name in self.extensions
+            if self.extension_hash(name) != self.extension_hashes.get(name)
+        ]
+
+    async def reload_extensions(
+        self, names: Iterable[str]
+    ) -> List[Tuple[str, float, Optional[Exception]]]:
+        """Reload extensions in place, one at a time, without disconnecting from Discord.
+
+        Return each extension with the seconds it took to reload, including waiting for its cogs
+        to finish their work, and the error if it failed and was rolled back.
+        """
+        results = []
+        self.extensions_ready.clear()
+        try:
+            for name in names:
+                start = time.perf_counter()
+                drained = await self.drain_extension(name)
+                try:
+                    await self.reload_extension(name)
+                except commands.ExtensionError as error:
+                    log.exception(f"Failed to reload {name}, kept the old version")
+                    results.append((name, time.perf_counter() - start, error))
+                else:
+                    log.info(f"Reloaded {name} in {time.perf_counter() - start:.3f}s")
+                    results.append((name, time.perf_counter() - start, None))
+                # a cog that wasn't replaced, because the reload failed before unloading it,
+                # goes back to work
+                for cog in drained:
+                    if self.get_cog(cog.qualified_name) is cog:
+                        cog.draining = False
+        finally:
+            self.extensions_ready.set()
+        return results
+
+    async def drain_extension(self, name: str) -> List[commands.Cog]:
+        """Let the cogs of an extension that have a drain method finish their work,
+        and return them.
+
+        discord.py removes a cog's commands before calling cog_unload, so cogs are drained
+        here first, while commands that arrive can still reach them.
+        """
+        drained = []
+        for cog in list(self.cogs.values()):
+            if cog.__module__ == name and hasattr(cog, "drain"):
+                await cog.drain()
+                drained.append(cog)
+        return drained
 
     async def on_ready(self):
         log.info(f"ready as {self.user.name}")
 
+        startup_profile = self.startup_profile
+        if startup_profile is not None:
+            ready_elapsed = startup_profile.elapsed()
+        if self.lazy_extensions:
+            await self.load_lazy_extensions()
+        if startup_profile is not None:
+            self.startup_profile = None
+            await self.report_startup_profile(startup_profile, ready_elapsed)
+
+    @staticmethod
+    async def report_startup_profile(startup_profile: StartupProfile, elapsed: float):
+        # profiled after the bot is ready, so it doesn't count towards the time it took
+        await asyncio.to_thread(
+            startup_profile.profile_imports,
+            ["snakeboxed.bot", *snakeboxed.cogs.EXTENSIONS],
+        )
+        startup_profile.report(elapsed)
+
     async def close(self):
+        self.loop_monitor.close()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        await self.snekbox_pool.close()
         await self.http_session.close()
         await super().close()
+        self.guild_settings.close()
+
+
+class AutoShardedSnakeboxed(Snakeboxed, commands.AutoShardedBot):
+    """Snakeboxed running several shards in one process.
+
+    Worker processes in a cluster share identify_lock, so that only one shard
+    across all of them identifies with Discord at a time.
+    """
+
+    def __init__(
+        self,
+        config: dict,
+        *args,
+        identify_lock: Optional[multiprocessing.synchronize.Lock] = None,
+        **kwargs,
+    ):
+        self.identify_lock = identify_lock
+        super().__init__(config, *args, **kwargs)
+
+    async def before_identify_hook(
+        self, shard_id: Optional[int], *, initial: bool = False
+    ):
+        if self.identify_lock is None:
+            return await super().before_identify_hook(shard_id, initial=initial)
+
+        await asyncio.to_thread(self.identify_lock.acquire)
+        # hold the lock until the next identify is allowed
+        self.loop.call_later(IDENTIFY_INTERVAL, self.identify_lock.release)
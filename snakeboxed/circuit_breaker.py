@@ -0,0 +1,60 @@
+import time
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_COOLDOWN = 30  # seconds
+
+
+class CircuitBreaker:
+    """Stop sending requests to a service that keeps failing, then try again after a cooldown.
+
+    After failure_threshold failures in a row the breaker opens and allow returns False.
+    Once the cooldown has passed, one trial request is allowed through;
+    the breaker closes if it succeeds and opens again if it fails.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        cooldown: float = DEFAULT_COOLDOWN,
+    ):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until a trial request is allowed, 0 if requests are allowed now."""
+        if self.opened_at is None:
+            return 0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow(self) -> bool:
+        """Return True if a request may be sent now."""
+        if self.opened_at is None:
+            return True
+        if self.trial_running or self.retry_after > 0:
+            return False
+        self.trial_running = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Record that a request ended without telling whether the service is up."""
+        self.trial_running = False
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import multiprocessing
+import multiprocessing.connection
+import multiprocessing.synchronize
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+import aiohttp
+
+import snakeboxed
+from snakeboxed.bot import AutoShardedSnakeboxed
+from snakeboxed.logs import DEFAULT_LOG_PATH, setup_logging
+from snakeboxed.startup_profile import StartupProfile
+from snakeboxed.tracing import DEFAULT_TRACE_PATH, setup_tracing
+
+GATEWAY_BOT_URL = "https://discord.com/api/v10/gateway/bot"
+
+
+log = logging.getLogger(__name__)
+
+
+async def fetch_recommended_shard_count(token: str) -> int:
+    """Ask Discord how many shards the bot should use."""
+    headers = {"Authorization": f"Bot {token}"}
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            GATEWAY_BOT_URL, headers=headers, raise_for_status=True
+        ) as resp:
+            gateway = await resp.json()
+    return gateway["shards"]
+
+
+def split_shards(shard_count: int, clusters: int) -> List[List[int]]:
+    """Split shard ids into contiguous ranges of nearly equal size, one per cluster."""
+    return [
+        list(range(i * shard_count // clusters, (i + 1) * shard_count // clusters))
+        for i in range(clusters)
+    ]
+
+
+def worker_config(config: dict, cluster_id: int) -> dict:
+    """Return the config for one worker, with its own metrics port so they don't clash."""
+    config = dict(config)
+    if "metrics" in config:
+        metrics_config = dict(config["metrics"])
+        metrics_config["port"] = metrics_config.get("port", 9100) + cluster_id
+        config["metrics"] = metrics_config
+    return config
+
+
+def run_worker(
+    config: dict,
+    cluster_id: int,
+    shard_ids: List[int],
+    shard_count: int,
+    identify_lock: multiprocessing.synchronize.Lock,
+    profile_startup: bool = False,
+):
+    # each worker profiles its own startup, from when its process started running
+    startup_profile = StartupProfile() if profile_startup else None
+    # rotating one log file from several processes would lose records
+    logging_config = config.get("logging", {})
+    log_path = Path(logging_config.get("path", DEFAULT_LOG_PATH))
+    setup_logging(
+        logging_config,
+        log_path=log_path.with_stem(f"{log_path.stem}-cluster{cluster_id}"),
+    )
+    tracing_config = config.get("tracing", {})
+    trace_path = Path(tracing_config.get("path", DEFAULT_TRACE_PATH))
+    setup_tracing(
+        tracing_config,
+        trace_path=trace_path.with_stem(f"{trace_path.stem}-cluster{cluster_id}"),
+    )
+
+    log.info(f"cluster {cluster_id} starting with shards {shard_ids} of {shard_count}")
+    snakeboxed.run_bot(
+        worker_config(config, cluster_id),
+        bot_class=AutoShardedSnakeboxed,
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+        identify_lock=identify_lock,
+        startup_profile=startup_profile,
+    )
+
+
+def launch(config: dict, startup_profile: Optional[StartupProfile] = None):
+    """Run the bot sharded, with the shards split across worker processes.
+
+    If any worker exits, the rest are stopped and the launcher exits with the same code,
+    so the whole cluster is restarted together.
+    With a startup profile, each worker profiles and reports its own startup.
+    """
+    sharding = config["sharding"]
+    clusters = sharding.get("clusters", 1)
+    shard_count = sharding.get("shard_count")
+
+    if clusters == 1 and shard_count is None:
+        # discord.py picks the shard count itself
+        snakeboxed.run_bot(
+            config, bot_class=AutoShardedSnakeboxed, startup_profile=startup_profile
+        )
+        return
+
+    if shard_count is None:
+        shard_count = asyncio.run(
+            fetch_recommended_shard_count(config["auth"]["token"])
+        )
+        log.info(f"using the recommended shard count of {shard_count}")
+    if shard_count < clusters:
+        raise ValueError(
+            f"can't split {shard_count} shards between {clusters} clusters"
+        )
+
+    context = multiprocessing.get_context("spawn")
+    identify_lock = context.Lock()
+    workers = [
+        context.Process(
+            target=run_worker,
+            args=(
+                config,
+                cluster_id,
+                shard_ids,
+                shard_count,
+                identify_lock,
+                startup_profile is not None,
+            ),
+            name=f"snakeboxed-cluster-{cluster_id}",
+        )
+        for cluster_id, shard_ids in enumerate(split_shards(shard_count, clusters))
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        ready = multiprocessing.connection.wait([worker.sentinel for worker in workers])
+        exited = next(worker for worker in workers if worker.sentinel in ready)
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in workers:
+            worker.join()
+
+    log.info(f"{exited.name} exited with code {exited.exitcode}, stopped the cluster")
+    sys.exit(exited.exitcode)
@@ -1,4 +1,27 @@
-from snakeboxed.cogs.owner import Owner
-from snakeboxed.cogs.python_info import PythonInfo
-from snakeboxed.cogs.snakeboxed_info import SnakeboxedInfo
-from snakeboxed.cogs.snekbox import Snekbox
+import importlib
+
+# loaded as extensions so they can be reloaded in place
+EXTENSIONS = (
+    "snakeboxed.cogs.owner",
+    "snakeboxed.cogs.python_info",
+    "snakeboxed.cogs.settings",
+    "snakeboxed.cogs.snakeboxed_info",
+    "snakeboxed.cogs.snekbox",
+)
+# not needed to start, loaded once the bot is ready or on first use
+LAZY_EXTENSIONS = ("snakeboxed.cogs.settings", "snakeboxed.cogs.snakeboxed_info")
+
+# the cog classes are only imported when they're used
+COG_MODULES = {
+    "Owner": "snakeboxed.cogs.owner",
+    "PythonInfo": "snakeboxed.cogs.python_info",
+    "Settings": "snakeboxed.cogs.settings",
+    "SnakeboxedInfo": "snakeboxed.cogs.snakeboxed_info",
+    "Snekbox": "snakeboxed.cogs.snekbox",
+}
+
+
+def __getattr__(name: str):
+    if name in COG_MODULES:
+        return getattr(importlib.import_module(COG_MODULES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
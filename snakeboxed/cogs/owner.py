@@ -1,19 +1,34 @@
+import asyncio
 import json
+import math
 import sys
+import tracemalloc
+from functools import partial
 from pathlib import Path
+from typing import Optional
 
 import discord
 from discord.ext import commands
 
 import snakeboxed
+from snakeboxed import metrics
+from snakeboxed.perf import (
+    DEFAULT_TOP,
+    DEFAULT_TRACEMALLOC_FRAMES,
+    MemorySnapshots,
+    current_rss_bytes,
+    peak_rss_bytes,
+)
 
 UPDATE_FILE_PATH = Path("update.json")
+MAX_MESSAGE_CHARS = 2000
 
 
 class Owner(commands.Cog):
     # todo cog base superclass with bot attribute
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.memory_snapshots = MemorySnapshots()
 
     async def cog_check(self, ctx: commands.Context) -> bool:
         if not await ctx.bot.is_owner(ctx.author):
@@ -25,8 +40,29 @@ class Owner(commands.Cog):
         await self.post_update()
 
     @commands.command(hidden=True, aliases=["u"])
-    async def update(self, ctx: commands.Context, exit_code: int = 0):
-        """Update the bot."""
+    async def update(self, ctx: commands.Context, *extensions: str):
+        """Update the bot in place by reloading the extensions that changed, or the ones given.
+
+        Running eval jobs are finished first, and the time each reload took is reported.
+        """
+        names = list(extensions) or ctx.bot.changed_extensions()
+        if not names:
+            return await ctx.send("No extensions changed.")
+
+        results = await ctx.bot.reload_extensions(names)
+        lines = [
+            (
+                f"{name}: reloaded in {seconds:.3f}s"
+                if error is None
+                else f"{name}: failed after {seconds:.3f}s, kept the old version ({error})"
+            )
+            for name, seconds, error in results
+        ]
+        return await ctx.send(f"{snakeboxed.__version__}\n" + "\n".join(lines))
+
+    @commands.command(hidden=True)
+    async def restart(self, ctx: commands.Context, exit_code: int = 0):
+        """Exit so the bot is restarted, for updates that can't be reloaded in place."""
         await ctx.send(snakeboxed.__version__)
 
         with open(UPDATE_FILE_PATH, "w") as update_file:
@@ -42,6 +78,106 @@ class Owner(commands.Cog):
         #      or handle SystemExit in runner
         sys.exit(exit_code)
 
+    @commands.command(hidden=True, name="cache")
+    async def cache_stats(self, ctx: commands.Context):
+        """Show how many snekbox runs the eval cache and shared runs of identical jobs saved."""
+        snekbox_cog = ctx.bot.get_cog("Snekbox")
+        if snekbox_cog is None:
+            return await ctx.send("Snekbox cog isn't loaded.")
+
+        eval_cache = snekbox_cog.eval_cache
+        return await ctx.send(
+            f"Eval cache enabled in {len(eval_cache.guilds)} guilds\n"
+            f"Hits: {eval_cache.hits} Misses: {eval_cache.misses} "
+            f"({eval_cache.hit_rate:.1%} of snekbox runs saved)\n"
+            f"Entries: {len(eval_cache)}/{eval_cache.max_entries} "
+            f"Size: {eval_cache.size}/{eval_cache.max_bytes} bytes\n"
+            f"Jobs that shared an identical job's run: {snekbox_cog.single_flight.shared} "
+            f"(out of {snekbox_cog.single_flight.runs} runs)"
+        )
+
+    @commands.group(hidden=True, invoke_without_command=True)
+    async def perf(self, ctx: commands.Context):
+        """Show event loop health, eval load, snekbox and Discord latency, and process usage,
+        to tell which of them is making the bot slow.
+        """
+        loop_monitor = ctx.bot.loop_monitor
+        snekbox_cog = ctx.bot.get_cog("Snekbox")
+
+        lines = [
+            f"Event loop lag: last {ms(loop_monitor.last_lag)}, "
+            f"p50 {ms(loop_monitor.lag_quantile(0.5))}, "
+            f"p99 {ms(loop_monitor.lag_quantile(0.99))}, "
+            f"max {ms(loop_monitor.lag_quantile(1))} "
+            f"over {loop_monitor.window_seconds:.0f}s",
+            f"Tasks: {len(asyncio.all_tasks())}",
+        ]
+        if snekbox_cog is not None:
+            lines.append(
+                f"Eval jobs running: {len(snekbox_cog.jobs)}, "
+                f"queued: {snekbox_cog.scheduler.queued}, "
+                f"re-eval sessions: {len(snekbox_cog.reeval_sessions)}"
+            )
+        recent = metrics.POST_EVAL_SECONDS.recent
+        lines += [
+            f"post_eval over the last {len(recent)} jobs: "
+            f"p50 {ms(metrics.POST_EVAL_SECONDS.recent_quantile(0.5))}, "
+            f"p99 {ms(metrics.POST_EVAL_SECONDS.recent_quantile(0.99))}",
+            f"Gateway latency: {ms(ctx.bot.latency)}",
+            f"Outbound requests waiting: {ctx.bot.outbound.pending}",
+            f"RSS: {mb(current_rss_bytes())} (peak {mb(peak_rss_bytes())}), "
+            f"CPU: {percent(loop_monitor.cpu_percent())} "
+            f"over {loop_monitor.window_seconds:.0f}s",
+        ]
+        threshold = loop_monitor.slow_callback_threshold()
+        lines.append(
+            "Slow callback logging: "
+            + ("off" if threshold is None else f"over {ms(threshold)}")
+        )
+        return await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+    @perf.command(name="slow")
+    async def perf_slow(
+        self, ctx: commands.Context, threshold_ms: Optional[float] = None
+    ):
+        """Log callbacks that block the event loop for longer than threshold_ms milliseconds,
+        or stop logging them if no threshold is given.
+        """
+        threshold = threshold_ms / 1000 if threshold_ms else None
+        ctx.bot.loop_monitor.log_slow_callbacks(threshold)
+        if threshold is None:
+            return await ctx.send("Stopped logging slow callbacks.")
+        return await ctx.send(f"Logging callbacks slower than {ms(threshold)}.")
+
+    @perf.group(name="memory", invoke_without_command=True)
+    async def perf_memory(self, ctx: commands.Context, top: int = DEFAULT_TOP):
+        """Take a tracemalloc snapshot and show the top lines of code by memory allocated,
+        with how much each has grown since the last snapshot.
+        """
+        if not self.memory_snapshots.is_tracing():
+            return await ctx.send(
+                "Not tracing allocations, start with `perf memory start`."
+            )
+        lines = await self.memory_snapshots.take(top)
+        header = f"RSS: {mb(current_rss_bytes())}, traced: {mb(tracemalloc.get_traced_memory()[0])}"
+        content = "```\n" + "\n".join([header, *lines])
+        # long paths can make the top lines too long for one message
+        return await ctx.send(content[: MAX_MESSAGE_CHARS - 4] + "\n```")
+
+    @perf_memory.command(name="start")
+    async def perf_memory_start(
+        self, ctx: commands.Context, frames: int = DEFAULT_TRACEMALLOC_FRAMES
+    ):
+        """Start tracing allocations, keeping frames frames of traceback for each."""
+        self.memory_snapshots.start(frames)
+        return await ctx.send(f"Tracing allocations with {frames} frames.")
+
+    @perf_memory.command(name="stop")
+    async def perf_memory_stop(self, ctx: commands.Context):
+        """Stop tracing allocations and forget the last snapshot."""
+        self.memory_snapshots.stop()
+        return await ctx.send("Stopped tracing allocations.")
+
     async def post_update(self):
         if not UPDATE_FILE_PATH.is_file():
             return
@@ -59,4 +195,27 @@ class Owner(commands.Cog):
         if update_channel is None:
             return
 
-        return await update_channel.send(snakeboxed.__version__)
+        return await self.bot.outbound.run(
+            update_channel.id,
+            None,
+            partial(update_channel.send, snakeboxed.__version__),
+        )
+
+
+def ms(seconds: Optional[float]) -> str:
+    # the gateway latency is nan until the first heartbeat
+    if seconds is None or math.isnan(seconds):
+        return "n/a"
+    return f"{seconds * 1000:.1f}ms"
+
+
+def mb(size: Optional[int]) -> str:
+    return "n/a" if size is None else f"{size / 2**20:.1f}MB"
+
+
+def percent(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.1f}%"
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(Owner(bot))
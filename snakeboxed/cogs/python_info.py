@@ -1,5 +1,10 @@
+from typing import Optional
+
+import discord
 from discord.ext import commands
 
+from snakeboxed.docs import DocsLookup, DocsUnavailable
+
 PYTHON_RESOURCES_HELP = """\
 https://www.python.org/
 Official Tutorial:
@@ -12,6 +17,8 @@ Built-ins:
 
 https://www.pythondiscord.com/resources/
 """
+# looks like a backtick, without ending the inline code a query is echoed in
+BACKTICK_LOOKALIKE = "\u02cb"
 
 
 class PythonInfo(commands.Cog):
@@ -19,6 +26,9 @@ class PythonInfo(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.docs_lookup = DocsLookup.from_config(
+            bot.http_session, bot.config.get("docs", {})
+        )
 
     qualified_name = "Python Info"
 
@@ -26,3 +36,40 @@ class PythonInfo(commands.Cog):
     async def python_resources(self, ctx: commands.Context):
         """Send some links to Python tutorials, documentation etc."""
         return await ctx.send(PYTHON_RESOURCES_HELP)
+
+    @commands.command(name="docs", aliases=["doc", "d"])
+    async def docs(self, ctx: commands.Context, *, query: Optional[str] = None):
+        """
+        Look up a symbol in the Python docs and link to it.
+        Search another package's docs with `docs <package> <symbol>`.
+        Names that don't match exactly are searched as prefixes, then for near misses.
+        """
+        if not query:
+            return await ctx.send_help(ctx.command)
+
+        packages = None
+        split = query.split(maxsplit=1)
+        if len(split) > 1 and split[0] in self.docs_lookup.sources:
+            packages, query = [split[0]], split[1]
+
+        try:
+            results = await self.docs_lookup.search(query, packages)
+        except DocsUnavailable as error:
+            return await ctx.send(f":x: The docs aren't available right now ({error}).")
+
+        if not results:
+            # the query is the user's, so it mustn't ping anyone
+            query = query.replace("`", BACKTICK_LOOKALIKE)
+            return await ctx.send(
+                f"No docs found for `{query}`.",
+                allowed_mentions=discord.AllowedMentions.none(),
+            )
+        lines = [
+            f"`{item.name}` ({package} {item.role}) <{item.url}>"
+            for package, item in results
+        ]
+        return await ctx.send("\n".join(lines))
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(PythonInfo(bot))
@@ -0,0 +1,100 @@
+from typing import Optional, Union
+
+import discord
+from discord.ext import commands
+
+from snakeboxed.bot import Snakeboxed
+from snakeboxed.guild_settings import CHANNEL, ROLE, USER
+
+# channels, roles and members given to the eval rule commands, tried in this order
+EvalRuleTarget = Union[
+    discord.TextChannel,
+    discord.Thread,
+    discord.CategoryChannel,
+    discord.Role,
+    discord.Member,
+]
+
+
+def rule_kind(target: EvalRuleTarget) -> str:
+    if isinstance(target, discord.Role):
+        return ROLE
+    if isinstance(target, discord.Member):
+        return USER
+    return CHANNEL
+
+
+class Settings(commands.Cog):
+    """Settings for this server, changed by members who can manage it."""
+
+    def __init__(self, bot: Snakeboxed):
+        self.bot = bot
+
+    async def cog_check(self, ctx: commands.Context) -> bool:
+        if ctx.guild is None:
+            raise commands.NoPrivateMessage()
+        if not ctx.author.guild_permissions.manage_guild:
+            raise commands.MissingPermissions(["manage_guild"])
+        return True
+
+    @commands.group(name="evalrules", aliases=["er"], invoke_without_command=True)
+    async def eval_rules(self, ctx: commands.Context):
+        """Show where eval is allowed in this server.
+
+        Rules for a member come first, then their roles, then the channel or its category.
+        An allowed member or role can use eval in any channel.
+        Once any channel or role is allowed, the others are denied.
+        """
+        rules = ctx.bot.guild_settings.eval_rules(ctx.guild.id)
+        lines = [
+            f"{label}: {', '.join(mention(target_id) for target_id in sorted(ids))}"
+            for label, ids, mention in (
+                ("Allowed members", rules.allowed_users, "<@{}>".format),
+                ("Denied members", rules.denied_users, "<@{}>".format),
+                ("Allowed roles", rules.allowed_roles, "<@&{}>".format),
+                ("Denied roles", rules.denied_roles, "<@&{}>".format),
+                ("Allowed channels", rules.allowed_channels, "<#{}>".format),
+                ("Denied channels", rules.denied_channels, "<#{}>".format),
+            )
+            if ids
+        ]
+        if not lines:
+            return await ctx.send("Eval is allowed everywhere in this server.")
+        return await ctx.send(
+            "\n".join(lines), allowed_mentions=discord.AllowedMentions.none()
+        )
+
+    async def set_rules(
+        self, ctx: commands.Context, targets: tuple, allow: Optional[bool]
+    ):
+        if not targets:
+            return await ctx.send_help(ctx.command)
+        for target in targets:
+            await ctx.bot.guild_settings.set_eval_rule(
+                ctx.guild.id, rule_kind(target), target.id, allow
+            )
+        return await ctx.message.add_reaction("\N{WHITE HEAVY CHECK MARK}")
+
+    @eval_rules.command(name="allow")
+    async def allow(self, ctx: commands.Context, *targets: EvalRuleTarget):
+        """Allow eval for channels, categories, roles or members."""
+        return await self.set_rules(ctx, targets, True)
+
+    @eval_rules.command(name="deny")
+    async def deny(self, ctx: commands.Context, *targets: EvalRuleTarget):
+        """Deny eval for channels, categories, roles or members."""
+        return await self.set_rules(ctx, targets, False)
+
+    @eval_rules.command(name="reset")
+    async def reset(self, ctx: commands.Context, *targets: EvalRuleTarget):
+        """Remove the rules for channels, categories, roles or members,
+        or every rule in this server if none are given.
+        """
+        if not targets:
+            await ctx.bot.guild_settings.clear_eval_rules(ctx.guild.id)
+            return await ctx.message.add_reaction("\N{WHITE HEAVY CHECK MARK}")
+        return await self.set_rules(ctx, targets, None)
+
+
+async def setup(bot: Snakeboxed):
+    await bot.add_cog(Settings(bot))
@@ -181,3 +181,7 @@ class SnakeboxedInfo(commands.Cog):
             client_id, permissions=permissions, guild=ctx.guild
         )
         await ctx.send(invite_url)
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(SnakeboxedInfo(bot))
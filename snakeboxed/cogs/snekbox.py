@@ -1,46 +1,84 @@
 import asyncio
 import contextlib
-import datetime
+import gzip
 import io
+import itertools
 import logging
+import math
 import re
 import textwrap
+import time
 from functools import partial
 from signal import Signals
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import discord
 from discord.ext import commands
 
+from snakeboxed import metrics, rate_limit, tracing
+from snakeboxed.attachments import AttachmentError, AttachmentReader, EvalFile
 from snakeboxed.bot import Snakeboxed
-
-ESCAPE_REGEX = re.compile("[`\u202E\u200B]{3,}")
-FORMATTED_CODE_REGEX = re.compile(
-    r"(?P<delim>(?P<block>```)|``?)"  # code delimiter: 1-3 backticks; (?P=block) only matches if it's a block
-    r"(?(block)(?:(?P<lang>[a-z]+)\n)?)"  # if we're in a block, match optional language (only letters plus newline)
-    r"(?:[ \t]*\n)*"  # any blank (empty or tabs/spaces only) lines before the code
-    r"(?P<code>.*?)"  # extract all code inside the markup
-    r"\s*"  # any more whitespace before the end of the code markup
-    r"(?P=delim)",  # match the exact same delimiter from the start again
-    re.DOTALL | re.IGNORECASE,  # '.' also matches newlines, case insensitive
-)
-RAW_CODE_REGEX = re.compile(
-    r"^(?:[ \t]*\n)*"  # any blank (empty or tabs/spaces only) lines before the code
-    r"(?P<code>.*?)"  # extract all the rest as code
-    r"\s*$",  # any trailing whitespace until the end of the string
-    re.DOTALL,  # '.' also matches newlines
+from snakeboxed.code_extract import find_code_spans, strip_raw_code
+from snakeboxed.eval_cache import EvalCache, code_key
+from snakeboxed.eval_job import DEFAULT_DEADLINE, EvalJob, JobCancelled
+from snakeboxed.logs import CODE_LOGGER_NAME, code_excerpt
+from snakeboxed.message_cache import (
+    MESSAGE_LINK_REGEX,
+    CachedMessage,
+    MessageCache,
+    MessageReferenceError,
 )
-PYTHON_CONTENT_TYPE = re.compile("text/x-python; charset=([a-z0-9-_]+)")
+from snakeboxed.rate_limit import RateLimited, RateLimiter
+from snakeboxed.reeval import REEVAL_EMOJI, ReevalSession, ReevalSessions
+from snakeboxed.scheduler import EvalScheduler, QueueFull
+from snakeboxed.single_flight import SingleFlight
+from snakeboxed.snekbox_pool import SnekboxTimeout, SnekboxUnavailable
+
+ESCAPE_REGEX = re.compile("[`\u202e\u200b]{3,}")
+ESCAPE_CHARACTERS = "`\u202e\u200b"
+# finds what ESCAPE_REGEX would find once mentions are escaped with a zero width space
+ESCAPE_AFTER_MENTION_REGEX = re.compile("[`\u202e\u200b]{3}|<!?@[`\u202e\u200b]{2}")
+# every escape attempt has at least two of these in a row
+ESCAPE_PAIRS = [a + b for a in ESCAPE_CHARACTERS for b in ESCAPE_CHARACTERS]
 
 SIGKILL = 9
-REEVAL_EMOJI = "\U0001f501"  # :repeat:
 REEVAL_TIMEOUT = 30
+REEVAL_REACTION_TIMEOUT = 10
+
+# seconds to wait for running jobs to finish before the cog is unloaded
+DRAIN_TIMEOUT = 60
+DRAIN_POLL_INTERVAL = 0.1
+
+# runs each fenced code block in a message as its own job
+EACH_FLAG = "--each"
+MAX_EACH_BLOCKS = 5
+# errors that stop an eval job, which the user is told about
+EVAL_ERRORS = (QueueFull, SnekboxUnavailable)
+
+MAX_OUTPUT_LINES = 10
+MAX_OUTPUT_CHARS = 1000
 
 MAX_DISCORD_FILE_LENGTH_BYTES = 8 * (10**6)  # 8MB
 DISCORD_FILE_NAME = "output.txt"
+DISCORD_GZIP_FILE_NAME = "output.txt.gz"
 
 
 log = logging.getLogger(__name__)
+code_log = logging.getLogger(CODE_LOGGER_NAME)
+
+
+class EvalNotAllowed(commands.CheckFailure):
+    """Raised when a guild's rules don't allow eval for a member in a channel."""
+
+
+def channel_ids(channel: discord.abc.Messageable) -> Tuple[int, ...]:
+    """Return the ids of a channel, its parent channel if it's a thread, and its category."""
+    ids = [channel.id]
+    for attribute in ("parent_id", "category_id"):
+        parent_id = getattr(channel, attribute, None)
+        if parent_id is not None:
+            ids.append(parent_id)
+    return tuple(ids)
 
 
 class Snekbox(commands.Cog):
@@ -48,46 +86,215 @@ class Snekbox(commands.Cog):
 
     qualified_name = "Snekbox"
 
-    def __init__(self, bot: Snakeboxed, snekbox_url: str):
+    def __init__(self, bot: Snakeboxed):
         self.bot = bot
-        self.jobs = {}
+        # each user's eval job in progress, by user id
+        self.jobs: Dict[int, EvalJob] = {}
+        self.job_timeout = bot.config.get("jobs", {}).get("deadline", DEFAULT_DEADLINE)
+        self.reeval_sessions = ReevalSessions()
+        self.eval_cache = EvalCache.from_config(bot.config.get("eval_cache", {}))
+        self.scheduler = EvalScheduler.from_config(bot.config.get("scheduler", {}))
+        self.single_flight = SingleFlight()
+        self.rate_limiter = RateLimiter.from_config(bot.config.get("rate_limits", {}))
+        self.attachment_reader = AttachmentReader.from_config(
+            bot.http_session, bot.config.get("attachments", {})
+        )
+        self.message_cache = MessageCache.from_config(
+            bot.config.get("message_cache", {})
+        )
+        # set when the cog is being unloaded, new jobs are handed over to the cog that replaces it
+        self.draining = False
+
+        metrics.EVAL_JOBS.set_function(lambda: len(self.jobs))
+        metrics.EVAL_QUEUE_DEPTH.set_function(lambda: self.scheduler.queued)
+
+    async def drain(self):
+        """Wait for running jobs to finish and end re-eval sessions.
+
+        Called by the bot before the cog's extension is reloaded, while the eval command is
+        still registered, so eval commands that arrive meanwhile are handed over to the new cog.
+        """
+        self.draining = True
+        self.reeval_sessions.close_all()
+
+        start = time.perf_counter()
+        running = len(self.jobs)
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while self.jobs and time.monotonic() < deadline:
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+
+        if self.jobs:
+            log.warning(f"Unloading with {len(self.jobs)} eval jobs still running")
+        log.info(f"Drained {running} eval jobs in {time.perf_counter() - start:.3f}s")
+
+    async def cog_unload(self):
+        """Drain the cog before it's removed, if it wasn't drained for a reload already.
+
+        By now discord.py has removed the cog's commands.
+        """
+        if not self.draining:
+            await self.drain()
+
+    async def cog_check(self, ctx: commands.Context) -> bool:
+        """Check the guild's rules for where eval is allowed, before the command is parsed."""
+        if ctx.guild is None:
+            return True
+        rules = self.bot.guild_settings.eval_rules(ctx.guild.id)
+        # roles are only listed if the guild has rules for them
+        role_ids = (role.id for role in getattr(ctx.author, "roles", ()))
+        if not rules.allows(ctx.author.id, role_ids, channel_ids(ctx.channel)):
+            raise EvalNotAllowed(f"{ctx.author} isn't allowed to eval in {ctx.channel}")
+        return True
+
+    async def cog_command_error(
+        self, ctx: commands.Context, error: commands.CommandError
+    ):
+        if isinstance(error, EvalNotAllowed):
+            log.info(f"Ignored a command in {ctx.guild} ({ctx.guild.id}): {error}")
+            return
+        # discord.py doesn't log errors for cogs with an error handler
+        log.error(f"Ignoring exception in command {ctx.command}", exc_info=error)
+
+    async def hand_over(self, ctx: commands.Context, code: Optional[str]):
+        """Run an eval command that came in while the cog was unloading on the cog replacing it."""
+        log.info(f"Handing {ctx.author}'s job over to the reloaded cog")
+        await self.bot.extensions_ready.wait()
+        new_cog = self.bot.get_cog(self.qualified_name)
+        if new_cog is None or new_cog is self:
+            return await ctx.send(
+                f"{ctx.author.mention} :x: Eval is unavailable right now, please try again later."
+            )
+        return await ctx.invoke(new_cog.eval_command, code=code)
 
-        self.snekbox_url = snekbox_url
-        self.snekbox_eval_api_url = f"{self.snekbox_url}/eval"
+    def acquire_rate_limits(self, ctx: commands.Context, jobs: int = 1):
+        """Take tokens for the jobs from the user's, channel's and guild's rate limits,
+        or raise RateLimited if any of them has run out.
+        """
+        try:
+            self.rate_limiter.acquire(
+                (
+                    (rate_limit.USER, ctx.author.id),
+                    (rate_limit.CHANNEL, ctx.channel.id),
+                    (rate_limit.GUILD, ctx.guild.id if ctx.guild else None),
+                ),
+                cost=jobs,
+            )
+        except RateLimited as error:
+            metrics.EVAL_RATE_LIMITED.inc(scope=error.scope)
+            raise
 
-    async def post_eval(self, code: str) -> dict:
+    async def post_eval(
+        self, code: str, files: List[EvalFile] = (), deadline: Optional[float] = None
+    ) -> dict:
         """Send a POST request to the Snekbox API to evaluate code and return the results."""
-        url = self.snekbox_eval_api_url
-        data = {"input": code}
-        async with self.bot.http_session.post(
-            url, json=data, raise_for_status=True
-        ) as resp:
-            return await resp.json()
+        snekbox_files = [file.to_snekbox() for file in files]
+        with metrics.POST_EVAL_SECONDS.time(), tracing.span(
+            "post_eval", files=len(files)
+        ):
+            return await self.bot.snekbox_pool.post_eval(code, snekbox_files, deadline)
+
+    async def evaluate(
+        self,
+        ctx: commands.Context,
+        code: str,
+        files: List[EvalFile] = (),
+        notify_queued: bool = True,
+        deadline: Optional[float] = None,
+    ) -> dict:
+        """
+        Evaluate code once the scheduler has a free slot and return the results.
+        Reuse cached results in guilds that opted in to the eval cache,
+        and share one snekbox run between identical jobs in progress at the same time,
+        unless the code comes with other files.
+        Retries are only made while they can finish before the deadline, in event loop time.
+        """
+        use_cache = self.eval_cache.enabled_for(ctx.guild) and not files
+        if use_cache:
+            results = self.eval_cache.get(code)
+            if results is not None:
+                log.info("Reusing cached results for identical code")
+                return results
+
+        if files:
+            return await self.schedule_eval(ctx, code, files, notify_queued, deadline)
+
+        key = code_key(code)
+        if key in self.single_flight:
+            log.info("Sharing the snekbox run of an identical job in progress")
+            metrics.EVAL_COALESCED.inc()
+        results = await self.single_flight.run(
+            key,
+            partial(
+                self.schedule_eval,
+                ctx,
+                code,
+                notify_queued=notify_queued,
+                deadline=deadline,
+            ),
+        )
+        if use_cache:
+            self.eval_cache.put(code, results)
+        return results
+
+    async def schedule_eval(
+        self,
+        ctx: commands.Context,
+        code: str,
+        files: List[EvalFile] = (),
+        notify_queued: bool = True,
+        deadline: Optional[float] = None,
+    ) -> dict:
+        """Evaluate code once the scheduler has a free slot in the guild's lane and return the results."""
+
+        async def on_queued(position: int):
+            await ctx.send(
+                f"{ctx.author.mention} Your eval job is queued at position {position}."
+            )
+
+        lane = ctx.guild.id if ctx.guild else None
+        # covers waiting for the slot as well as post_eval
+        with tracing.span("schedule_eval"):
+            async with self.scheduler.slot(
+                lane, on_queued=on_queued if notify_queued else None
+            ):
+                return await self.post_eval(code, files, deadline)
 
     @staticmethod
     async def output_to_discord_file(output: str) -> Optional[discord.File]:
-        """Upload the eval output to a Discord file and return it if successful."""
-        log.info("Uploading full output to Discord file...")
+        """Upload the eval output to a Discord file and return it if successful.
 
-        output_bytes = output.encode(encoding="utf_8")
-        if len(output_bytes) > MAX_DISCORD_FILE_LENGTH_BYTES:
-            log.info("Full output is too long to upload")
-            output_bytes = b"too long to upload"
+        Output too big for Discord is gzip compressed in a worker thread.
+        """
+        log.info("Uploading full output to Discord file...")
 
-        output_bytes_io = io.BytesIO(output_bytes)
-        output_bytes_io.seek(0)
-        output_discord_file = discord.File(output_bytes_io, filename=DISCORD_FILE_NAME)
+        with tracing.span("output_to_discord_file", chars=len(output)):
+            output_bytes = output.encode(encoding="utf_8")
+            filename = DISCORD_FILE_NAME
+            if len(output_bytes) > MAX_DISCORD_FILE_LENGTH_BYTES:
+                log.info("Full output is too long to upload, compressing it")
+                output_bytes = await asyncio.to_thread(gzip.compress, output_bytes)
+                filename = DISCORD_GZIP_FILE_NAME
+                if len(output_bytes) > MAX_DISCORD_FILE_LENGTH_BYTES:
+                    log.info("Compressed output is still too long to upload")
+                    output_bytes = b"too long to upload"
+                    filename = DISCORD_FILE_NAME
+
+            output_bytes_io = io.BytesIO(output_bytes)
+            output_discord_file = discord.File(output_bytes_io, filename=filename)
 
         return output_discord_file
 
-    @staticmethod
-    async def code_from_attachments(message: discord.Message) -> Optional[str]:
-        for attachment in message.attachments:
-            content_type_match = re.match(PYTHON_CONTENT_TYPE, attachment.content_type)
-            if content_type_match:
-                encoding = content_type_match.group(1)
-                attachment_bytes = await attachment.read()
-                return attachment_bytes.decode(encoding=encoding)
+    async def code_from_attachments(
+        self, message: discord.Message
+    ) -> Tuple[Optional[str], List[EvalFile]]:
+        """
+        Return the code to run from the Python files and zip archives attached to the message,
+        and the other files it needs. The files are run together as a multi-file job.
+        """
+        code, files = await self.attachment_reader.read_code(message)
+        if code is not None:
+            log.info(f"Read code and {len(files)} other files from attachments")
+        return code, files
 
     @staticmethod
     def prepare_input(code: str) -> str:
@@ -97,15 +304,15 @@ class Snekbox(commands.Cog):
         Use the first code block, but prefer a fenced code block.
         If there are several fenced code blocks, concatenate only the fenced code blocks.
         """
-        if match := list(FORMATTED_CODE_REGEX.finditer(code)):
-            blocks = [block for block in match if block.group("block")]
+        if spans := find_code_spans(code):
+            blocks = [span for span in spans if span.block]
 
             if len(blocks) > 1:
-                code = "\n".join(block.group("code") for block in blocks)
+                code = "\n".join(block.code for block in blocks)
                 info = "several code blocks"
             else:
-                match = match[0] if len(blocks) == 0 else blocks[0]
-                code, block, lang, delim = match.group("code", "block", "lang", "delim")
+                span = spans[0] if len(blocks) == 0 else blocks[0]
+                code, block, lang, delim = span.code, span.block, span.lang, span.delim
                 if block:
                     info = (
                         f"'{lang}' highlighted" if lang else "plain"
@@ -113,13 +320,33 @@ class Snekbox(commands.Cog):
                 else:
                     info = f"{delim}-enclosed inline code"
         else:
-            code = RAW_CODE_REGEX.fullmatch(code).group("code")
+            code = strip_raw_code(code)
             info = "unformatted or badly formatted code"
 
         code = textwrap.dedent(code)
-        log.info(f"Extracted {info} for evaluation:\n{code}")
+        code_log.info(f"Extracted {info} for evaluation:\n{code_excerpt(code)}")
         return code
 
+    @staticmethod
+    def split_each_flag(code: str) -> Tuple[bool, str]:
+        """Return whether the code starts with the --each flag, and the code without it."""
+        split = code.split(maxsplit=1)
+        if split and split[0] == EACH_FLAG:
+            return True, split[1] if len(split) > 1 else ""
+        return False, code
+
+    @staticmethod
+    def prepare_blocks(code: str) -> List[str]:
+        """Extract each fenced code block from the Markdown to be evaluated separately."""
+        blocks = [
+            textwrap.dedent(span.code) for span in find_code_spans(code) if span.block
+        ]
+        for i, block in enumerate(blocks, 1):
+            code_log.info(
+                f"Extracted code block {i} for evaluation:\n{code_excerpt(block)}"
+            )
+        return blocks
+
     @staticmethod
     def get_results_message(results: dict) -> Tuple[str, str]:
         """Return a user-friendly message and error corresponding to the process's return code."""
@@ -145,6 +372,23 @@ class Snekbox(commands.Cog):
 
         return msg, error
 
+    @staticmethod
+    def get_results_category(results: dict) -> str:
+        """Return a short name for the kind of result, matching get_results_message."""
+        returncode = results["returncode"]
+        if returncode is None:
+            return "failed"
+        elif returncode == 0:
+            return "success"
+        elif returncode == 128 + SIGKILL:
+            return "timeout_or_oom"
+        elif returncode == 255:
+            return "nsjail_error"
+        elif returncode > 128:
+            return "signal"
+        else:
+            return "error"
+
     @staticmethod
     def get_status_emoji(results: dict) -> str:
         """Return an emoji corresponding to the status code or lack of output in result."""
@@ -155,115 +399,348 @@ class Snekbox(commands.Cog):
         else:  # Exception
             return ":x:"
 
-    async def format_output(self, output: str) -> Tuple[str, Optional[discord.File]]:
+    @staticmethod
+    def escape_mentions(output: str) -> str:
+        """Put a zero width space after the start of each mention so it doesn't ping anyone."""
+        if "<@" in output:
+            output = output.replace("<@", "<@\u200b")
+        if "<!@" in output:
+            output = output.replace("<!@", "<!@\u200b")
+        return output
+
+    @staticmethod
+    def is_escape_attempt(output: str) -> bool:
+        """Return True if the output would escape its code block once mentions are escaped."""
+        # substring search is much faster than the regex, and usually rules out an escape attempt
+        if not any(pair in output for pair in ESCAPE_PAIRS):
+            return False
+        return ESCAPE_AFTER_MENTION_REGEX.search(output) is not None
+
+    @staticmethod
+    def find_line_end(output: str, max_lines: int) -> int:
+        """Return the index of the newline ending line number max_lines, or -1 if there are fewer lines.
+
+        Only scans as far as that newline.
+        """
+        end = -1
+        for _ in range(max_lines):
+            end = output.find("\n", end + 1)
+            if end == -1:
+                break
+        return end
+
+    async def format_output(
+        self, output: str, max_chars: int = MAX_OUTPUT_CHARS
+    ) -> Tuple[str, Optional[discord.File]]:
         """
         Format the output and return a tuple of the formatted output and a URL to the full output.
-        Prepend each line with a line number. Truncate if there are over 10 lines or 1000 characters
-        and upload the full output to a Discord file.
+        Prepend each line with a line number. Truncate if there are over 10 lines or max_chars
+        characters and upload the full output to a Discord file.
+        Only the start of the output needed for the preview is formatted, so huge outputs stay cheap.
         """
         log.info("Formatting output...")
 
         output = output.rstrip("\n")
-        original_output = output  # To be uploaded to a Discord file if needed
-        discord_file = None
-
-        if "<@" in output:
-            output = output.replace("<@", "<@\u200B")  # Zero-width space
-
-        if "<!@" in output:
-            output = output.replace("<!@", "<!@\u200B")  # Zero-width space
 
-        if ESCAPE_REGEX.findall(output):
-            discord_file = await self.output_to_discord_file(original_output)
+        if self.is_escape_attempt(output):
+            discord_file = await self.output_to_discord_file(output)
             return (
                 "Code block escape attempt detected; will not output result",
                 discord_file,
             )
 
-        truncated = False
-        lines = output.count("\n")
-
-        if lines > 0:
-            output = [
-                f"{i:03d} | {line}" for i, line in enumerate(output.split("\n"), 1)
-            ]
-            output = output[:11]  # Limiting to only 11 lines
-            output = "\n".join(output)
+        # the newline ending the first line past the limit, if there is one
+        line_end = self.find_line_end(output, MAX_OUTPUT_LINES + 1)
+        too_many_lines = line_end != -1
+        head = output[:line_end] if too_many_lines else output
+
+        # escaping mentions and numbering lines only make the preview longer
+        too_long = len(head) >= max_chars
+        if not too_long:
+            preview = self.escape_mentions(head)
+            if "\n" in preview:
+                preview = "\n".join(
+                    f"{i:03d} | {line}" for i, line in enumerate(preview.split("\n"), 1)
+                )
+            too_long = len(preview) >= max_chars
+
+        if too_many_lines and too_long:
+            preview = "... (truncated - too long, too many lines)"
+        elif too_many_lines:
+            preview = "... (truncated - too many lines)"
+        elif too_long:
+            preview = "... (truncated - too long)"
+        else:
+            return preview or "[No output]", None
+
+        discord_file = await self.output_to_discord_file(output)
+        return preview, discord_file
+
+    async def respond(
+        self,
+        ctx: commands.Context,
+        response: Optional[discord.Message],
+        content: str,
+        discord_files: List[discord.File] = (),
+    ) -> discord.Message:
+        """Send a response, or edit the previous one in place when re-evaluating,
+        replacing its attachments. Return the response.
+        """
+        if response is not None:
+            try:
+                return await self.bot.outbound.run(
+                    response.channel.id,
+                    ("edit", response.id),
+                    partial(
+                        response.edit, content=content, attachments=list(discord_files)
+                    ),
+                )
+            except discord.NotFound:
+                log.info(f"Response {response.id} was deleted, sending a new one")
+                for discord_file in discord_files:
+                    discord_file.reset()
+        return await ctx.send(content, files=list(discord_files) or None)
+
+    async def send_eval(
+        self,
+        ctx: commands.Context,
+        code: str,
+        files: List[EvalFile] = (),
+        response: Optional[discord.Message] = None,
+        deadline: Optional[float] = None,
+    ) -> discord.Message:
+        """
+        Evaluate code, format it, and send the output to the corresponding channel,
+        or edit it into the previous response. Return the bot response.
+        """
+        async with ctx.typing():
+            try:
+                results = await self.evaluate(ctx, code, files, deadline=deadline)
+            except EVAL_ERRORS as error:
+                return await self.respond(
+                    ctx,
+                    response,
+                    f"{ctx.author.mention} {self.get_eval_error_message(ctx, error)}",
+                )
+            summary, output, discord_file = await self.format_results(results)
+
+            msg = f"{ctx.author.mention} {summary}.\n\n```\n{output}\n```"
+            with metrics.DISCORD_SEND_SECONDS.time(), tracing.span("send"):
+                if discord_file:
+                    response = await self.respond(
+                        ctx, response, f"{msg}\nFull output: ", [discord_file]
+                    )
+                else:
+                    response = await self.respond(ctx, response, msg)
 
-        if lines > 10:
-            truncated = True
-            if len(output) >= 1000:
-                output = "... (truncated - too long, too many lines)"
-            else:
-                output = "... (truncated - too many lines)"
-        elif len(output) >= 1000:
-            truncated = True
-            output = "... (truncated - too long)"
+            log.info(f"{ctx.author}'s job had a return code of {results['returncode']}")
+        return response
 
-        if truncated:
-            discord_file = await self.output_to_discord_file(original_output)
+    async def send_eval_each(
+        self,
+        ctx: commands.Context,
+        blocks: List[str],
+        response: Optional[discord.Message] = None,
+        deadline: Optional[float] = None,
+    ) -> discord.Message:
+        """
+        Evaluate each code block as its own job concurrently, and send all the outputs
+        to the corresponding channel in one message, or edit them into the previous response.
+        Return the bot response.
+        """
+        async with ctx.typing():
+            outcomes = await asyncio.gather(
+                *(
+                    self.evaluate(ctx, block, notify_queued=i == 0, deadline=deadline)
+                    for i, block in enumerate(blocks)
+                ),
+                return_exceptions=True,
+            )
 
-        output = output or "[No output]"
+            # share the space for output between the blocks
+            max_chars = MAX_OUTPUT_CHARS // len(blocks)
+            parts = []
+            discord_files = []
+            for i, outcome in enumerate(outcomes, 1):
+                if isinstance(outcome, EVAL_ERRORS):
+                    parts.append(
+                        f"**Block {i}:** {self.get_eval_error_message(ctx, outcome)}"
+                    )
+                    continue
+                elif isinstance(outcome, BaseException):
+                    raise outcome
+
+                summary, output, discord_file = await self.format_results(
+                    outcome, max_chars
+                )
+                parts.append(f"**Block {i}:** {summary}.\n```\n{output}\n```")
+                if discord_file:
+                    discord_file.filename = f"block{i}-{discord_file.filename}"
+                    discord_files.append(discord_file)
+                log.info(
+                    f"{ctx.author}'s job for block {i} had a return code of {outcome['returncode']}"
+                )
 
-        return output, discord_file
+            msg = (
+                f"{ctx.author.mention} Your {len(blocks)} eval jobs have finished.\n\n"
+            )
+            msg += "\n".join(parts)
+            with metrics.DISCORD_SEND_SECONDS.time(), tracing.span("send"):
+                if discord_files:
+                    response = await self.respond(
+                        ctx, response, f"{msg}\nFull output: ", discord_files
+                    )
+                else:
+                    response = await self.respond(ctx, response, msg)
+        return response
 
-    async def send_eval(self, ctx: commands.Context, code: str) -> discord.Message:
+    async def format_results(
+        self, results: dict, max_chars: int = MAX_OUTPUT_CHARS
+    ) -> Tuple[str, str, Optional[discord.File]]:
         """
-        Evaluate code, format it, and send the output to the corresponding channel.
-        Return the bot response.
+        Return a summary of the results with a status emoji, the formatted output,
+        and a Discord file with the full output if it had to be truncated.
         """
-        async with ctx.typing():
-            results = await self.post_eval(code)
+        with tracing.span("get_results_message"):
             msg, error = self.get_results_message(results)
+        metrics.EVAL_RESULTS.inc(category=self.get_results_category(results))
 
-            if error:
-                output, discord_file = error, None
-            else:
-                output, discord_file = await self.format_output(results["stdout"])
+        if error:
+            output, discord_file = error, None
+        else:
+            with metrics.FORMAT_OUTPUT_SECONDS.time(), tracing.span("format_output"):
+                output, discord_file = await self.format_output(
+                    results["stdout"], max_chars
+                )
 
-            icon = self.get_status_emoji(results)
-            msg = f"{ctx.author.mention} {icon} {msg}.\n\n```\n{output}\n```"
-            if discord_file:
-                response = await ctx.send(f"{msg}\nFull output: ", file=discord_file)
-            else:
-                response = await ctx.send(msg)
+        icon = self.get_status_emoji(results)
+        return f"{icon} {msg}", output, discord_file
 
-            log.info(f"{ctx.author}'s job had a return code of {results['returncode']}")
-        return response
+    @staticmethod
+    def get_eval_error_message(ctx: commands.Context, error: Exception) -> str:
+        """Log an error that stopped an eval job and return a user-friendly message for it."""
+        if isinstance(error, MessageReferenceError):
+            log.info(f"Couldn't use the message {ctx.author} referenced: {error}")
+            return f":x: {error}"
+        elif isinstance(error, JobCancelled):
+            log.info(f"{ctx.author}'s job was cancelled: {error}")
+            return f":stop_button: Your eval job was cancelled ({error})."
+        elif isinstance(error, asyncio.TimeoutError):
+            log.info(f"{ctx.author}'s job was stopped at its deadline")
+            return ":alarm_clock: Your eval job took too long and was stopped."
+        elif isinstance(error, RateLimited):
+            log.info(f"Rejected {ctx.author}'s job, {error}")
+            too_often = {
+                rate_limit.USER: "You're running code too often",
+                rate_limit.CHANNEL: "Code is being run too often in this channel",
+                rate_limit.GUILD: "Code is being run too often in this server",
+            }[error.scope]
+            return (
+                f":hourglass: {too_often}, "
+                f"please try again in {math.ceil(error.retry_after)} seconds."
+            )
+        elif isinstance(error, QueueFull):
+            log.info(f"Rejected {ctx.author}'s job, the eval queue is full")
+            return (
+                ":hourglass: Too many eval jobs are waiting right now, "
+                "please try again later."
+            )
+        elif isinstance(error, SnekboxTimeout):
+            log.warning(f"{ctx.author}'s job timed out waiting for snekbox")
+            return (
+                ":x: The eval server took too long to respond, please try again later."
+            )
+        else:
+            log.warning(f"Couldn't evaluate {ctx.author}'s job: {error}")
+            retry_after = (
+                f"in {math.ceil(error.retry_after)} seconds"
+                if error.retry_after
+                else "later"
+            )
+            return (
+                ":x: The eval server is unavailable right now, "
+                f"please try again {retry_after}."
+            )
 
     async def continue_eval(
-        self, ctx: commands.Context, response: discord.Message
+        self, ctx: commands.Context, response: discord.Message, session: ReevalSession
     ) -> Optional[str]:
         """
         Check if the eval session should continue.
         Return the new code to evaluate or None if the eval session should be terminated.
         """
-        _predicate_eval_message_edit = partial(predicate_eval_message_edit, ctx)
-        _predicate_emoji_reaction = partial(predicate_eval_emoji_reaction, ctx)
-
+        reacted = False
         with contextlib.suppress(discord.NotFound):
             try:
-                _, new_message = await self.bot.wait_for(
-                    "message_edit",
-                    check=_predicate_eval_message_edit,
-                    timeout=REEVAL_TIMEOUT,
-                )
-                await ctx.message.add_reaction(REEVAL_EMOJI)
-                await self.bot.wait_for(
-                    "reaction_add", check=_predicate_emoji_reaction, timeout=10
-                )
+                new_message = await session.wait_for_edit(timeout=REEVAL_TIMEOUT)
+                reacted = True
+                await self.set_reeval_reaction(ctx.message, True)
+                await session.wait_for_reaction(timeout=REEVAL_REACTION_TIMEOUT)
 
-                code = await self.get_code(new_message)
-                await ctx.message.clear_reaction(REEVAL_EMOJI)
-                with contextlib.suppress(discord.HTTPException):
-                    await response.delete()
+                with tracing.span("get_code"):
+                    code = await self.get_code(new_message)
+                await self.set_reeval_reaction(ctx.message, False)
 
             except asyncio.TimeoutError:
-                await ctx.message.clear_reaction(REEVAL_EMOJI)
+                # there's only a reaction to clear if the message was edited
+                if reacted:
+                    await self.set_reeval_reaction(ctx.message, False)
                 return None
 
             return code
 
+    @commands.command(name="cancel", aliases=("stop",))
+    async def cancel_command(self, ctx: commands.Context):
+        """Cancel your eval job that's running."""
+        job = self.jobs.get(ctx.author.id)
+        if job is None or not job.cancel("you cancelled it"):
+            return await ctx.send(
+                f"{ctx.author.mention} You don't have an eval job running."
+            )
+
+    async def set_reeval_reaction(self, message: discord.Message, added: bool):
+        """Add or clear the re-eval reaction on a message through the outbound queue,
+        where a waiting add and clear of it are merged into the last one.
+        """
+        function = message.add_reaction if added else message.clear_reaction
+        await self.bot.outbound.run(
+            message.channel.id,
+            ("reaction", message.id, REEVAL_EMOJI),
+            partial(function, REEVAL_EMOJI),
+        )
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        if message.content:
+            self.message_cache.put(CachedMessage.from_message(message))
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        if "content" in payload.data:
+            self.message_cache.update(payload.message_id, payload.data["content"])
+        session = self.reeval_sessions.dispatch_edit(payload)
+        if session is None:
+            return
+        # an edit made while the message's job is running replaces the job
+        job = self.jobs.get(session.author_id)
+        if job is not None and job.message_id == session.message_id:
+            job.cancel("the message was edited")
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        self.message_cache.remove(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(
+        self, payload: discord.RawBulkMessageDeleteEvent
+    ):
+        for message_id in payload.message_ids:
+            self.message_cache.remove(message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        self.reeval_sessions.dispatch_reaction(payload)
+
     async def get_code(self, message: discord.Message) -> Optional[str]:
         """
         Return the code from `message` to be evaluated.
@@ -283,16 +760,88 @@ class Snekbox(commands.Cog):
 
         return code
 
+    async def referenced_code(
+        self, ctx: commands.Context, channel_id: int, message_id: int
+    ) -> str:
+        """
+        Return the code in a message the author can read in the same server, or DM channel.
+        If the message invokes the eval command, use its argument, like get_code.
+        The message's content is taken from the message cache, and only fetched if it isn't there.
+        Raises MessageReferenceError if it can't be used.
+        """
+        if ctx.guild is None:
+            channel = ctx.channel if channel_id == ctx.channel.id else None
+        else:
+            channel = ctx.guild.get_channel_or_thread(channel_id)
+        if channel is None:
+            raise MessageReferenceError("That message isn't in this server.")
+        if ctx.guild is not None:
+            permissions = channel.permissions_for(ctx.author)
+            if not (permissions.read_messages and permissions.read_message_history):
+                raise MessageReferenceError("You can't read messages in that channel.")
+
+        try:
+            cached = await self.message_cache.fetch(channel, message_id)
+        except discord.NotFound:
+            raise MessageReferenceError("That message doesn't exist.") from None
+        except discord.Forbidden:
+            raise MessageReferenceError(
+                "I can't read messages in that channel."
+            ) from None
+        # the cache is by message id only, so a link can't name another channel to get past the checks
+        if cached.channel_id != channel_id:
+            raise MessageReferenceError("That message doesn't exist.")
+
+        code = cached.content
+        prefixes = await self.bot.get_prefix(ctx.message)
+        for prefix in [prefixes] if isinstance(prefixes, str) else prefixes:
+            if code.startswith(prefix):
+                split = code[len(prefix) :].split(maxsplit=1)
+                if split and self.bot.get_command(split[0]) is self.eval_command:
+                    code = split[1] if len(split) > 1 else ""
+                break
+        if not code:
+            raise MessageReferenceError("That message doesn't have any code in it.")
+        return code
+
+    async def code_from_link(self, ctx: commands.Context, link: str) -> str:
+        """Return the code in the message a link points to, see referenced_code."""
+        match = MESSAGE_LINK_REGEX.fullmatch(link)
+        log.info(f"Getting code from linked message {match['message_id']}")
+        return await self.referenced_code(
+            ctx, int(match["channel_id"]), int(match["message_id"])
+        )
+
+    async def code_from_reply(self, ctx: commands.Context) -> str:
+        """Return the code in the message the command replied to, see referenced_code.
+
+        Replies usually come with the message they reply to, which is cached so it isn't fetched.
+        """
+        reference = ctx.message.reference
+        if isinstance(reference.resolved, discord.Message):
+            self.message_cache.put(CachedMessage.from_message(reference.resolved))
+        log.info(f"Getting code from replied to message {reference.message_id}")
+        return await self.referenced_code(
+            ctx, reference.channel_id, reference.message_id
+        )
+
     @commands.command(name="eval", aliases=("e", "exec"))
     async def eval_command(self, ctx: commands.Context, *, code: str = None):
         """
         Run Python code and get the results.
         This command supports multiple lines of code, including code wrapped inside a formatted code
         block. Code can be re-evaluated by editing the original message within 10 seconds and
-        clicking the reaction that subsequently appears.
+        clicking the reaction that subsequently appears, the results are updated in place.
+        Code can also be attached as .py files or zip archives of them, the file to run is main.py
+        if there is one, or taken from another message by linking to it or replying to it.
+        Start with --each to run each fenced code block separately at the same time.
+        A running job can be stopped with the cancel command, or by editing the message.
         We've done our best to make this sandboxed, but do let us know if you manage to find an
         issue with it!
         """
+        if self.draining:
+            return await self.hand_over(ctx, code)
+
         if ctx.author.id in self.jobs:
             await ctx.send(
                 f"{ctx.author.mention} You've already got a job running - "
@@ -301,48 +850,155 @@ class Snekbox(commands.Cog):
             return
 
         skip_input_prep = False
-        if not code:
-            code = await self.code_from_attachments(ctx.message)
+        each = False
+        files = []
+        # rate limit tokens already taken for the first job
+        jobs_paid = 0
+        if code:
+            each, code = self.split_each_flag(code)
+        elif ctx.message.reference is not None and not ctx.message.attachments:
+            try:
+                # before the replied to message is fetched, if it has to be
+                self.acquire_rate_limits(ctx)
+                jobs_paid = 1
+                code = await self.code_from_reply(ctx)
+            except (RateLimited, MessageReferenceError) as error:
+                return await ctx.send(
+                    f"{ctx.author.mention} {self.get_eval_error_message(ctx, error)}"
+                )
+        else:
+            try:
+                code, files = await self.code_from_attachments(ctx.message)
+            except AttachmentError as error:
+                log.info(f"Couldn't use {ctx.author}'s attachments: {error}")
+                return await ctx.send(f"{ctx.author.mention} :x: {error}")
             skip_input_prep = True
 
         if not code:  # None or empty string
             return await ctx.send_help(ctx.command)
 
-        log.info(
-            f"Received code from "
-            f"{ctx.author} ({ctx.author.id}) "
-            f"in {ctx.guild} ({ctx.guild.id}) for evaluation:\n"
-            f"{code}"
-        )
-
-        while True:
-            self.jobs[ctx.author.id] = datetime.datetime.now()
+        with tracing.TRACER.trace(
+            "eval",
+            guild_id=ctx.guild.id if ctx.guild else None,
+            channel_id=ctx.channel.id,
+        ) as trace:
+            code_log.info(
+                f"Received code from "
+                f"{ctx.author} ({ctx.author.id}) "
+                f"in {ctx.guild} ({ctx.guild.id}) for evaluation"
+                f"{f' (trace {trace.trace_id})' if trace else ''}:\n"
+                f"{code_excerpt(code)}"
+            )
+            await self.run_session(ctx, code, files, each, skip_input_prep, jobs_paid)
+
+    async def run_session(
+        self,
+        ctx: commands.Context,
+        code: str,
+        files: List[EvalFile],
+        each: bool,
+        skip_input_prep: bool,
+        jobs_paid: int = 0,
+    ):
+        """Run an eval job, then run it again each time the message is edited to re-evaluate.
+
+        jobs_paid is the number of jobs rate limit tokens were already taken for,
+        which only counts for the first run.
+        """
+        session = self.reeval_sessions.start(ctx.message, ctx.author.id)
+        response = None
+        try:
+            for iteration in itertools.count():
+                job = EvalJob.start(ctx.author.id, ctx.message.id, self.job_timeout)
+                self.jobs[ctx.author.id] = job
+                with tracing.span("iteration", iteration=iteration, each=each):
+                    response = await self.run_job(
+                        ctx,
+                        job,
+                        code,
+                        files,
+                        each,
+                        skip_input_prep,
+                        response,
+                        jobs_paid,
+                    )
+                jobs_paid = 0
+
+                with tracing.span("wait_for_reeval"):
+                    code = await self.continue_eval(ctx, response, session)
+                if code:
+                    each, code = self.split_each_flag(code)
+                if not code:
+                    break
+                code_log.info(
+                    f"Re-evaluating code from message {ctx.message.id}:\n{code_excerpt(code)}"
+                )
+        finally:
+            self.reeval_sessions.stop(session)
+
+    async def run_job(
+        self,
+        ctx: commands.Context,
+        job: EvalJob,
+        code: str,
+        files: List[EvalFile],
+        each: bool,
+        skip_input_prep: bool,
+        response: Optional[discord.Message],
+        jobs_paid: int = 0,
+    ) -> discord.Message:
+        """Run one iteration of an eval session as a job and return the response.
+
+        Rate limit tokens are taken before any work is done for the job, less jobs_paid.
+        """
+        try:
+            if MESSAGE_LINK_REGEX.fullmatch(code.strip()):
+                # before the linked message is fetched, if it has to be
+                if not jobs_paid:
+                    self.acquire_rate_limits(ctx)
+                    jobs_paid = 1
+                with tracing.span("get_linked_code"):
+                    code = await self.code_from_link(ctx, code.strip())
+            blocks = []
+            if each:
+                with tracing.span("prepare_input"):
+                    blocks = self.prepare_blocks(code)
+            if len(blocks) > MAX_EACH_BLOCKS:
+                return await self.respond(
+                    ctx,
+                    response,
+                    f"{ctx.author.mention} :x: {EACH_FLAG} can run up to "
+                    f"{MAX_EACH_BLOCKS} code blocks at once.",
+                )
+            jobs = max(len(blocks), 1)
+            if jobs > jobs_paid:
+                self.acquire_rate_limits(ctx, jobs - jobs_paid)
+            if len(blocks) > 1:
+                return await job.run(
+                    self.send_eval_each(ctx, blocks, response, job.deadline)
+                )
             if not skip_input_prep:
-                code = self.prepare_input(code)
-            try:
-                response = await self.send_eval(ctx, code)
-            finally:
+                with tracing.span("prepare_input"):
+                    code = self.prepare_input(code)
+            return await job.run(
+                self.send_eval(ctx, code, files, response, job.deadline)
+            )
+        except (
+            MessageReferenceError,
+            RateLimited,
+            JobCancelled,
+            asyncio.TimeoutError,
+        ) as error:
+            return await self.respond(
+                ctx,
+                response,
+                f"{ctx.author.mention} {self.get_eval_error_message(ctx, error)}",
+            )
+        finally:
+            # also reached if the command itself is cancelled
+            if self.jobs.get(ctx.author.id) is job:
                 del self.jobs[ctx.author.id]
 
-            code = await self.continue_eval(ctx, response)
-            if not code:
-                break
-            log.info(f"Re-evaluating code from message {ctx.message.id}:\n{code}")
-
-
-def predicate_eval_message_edit(
-    ctx: commands.Context, old_msg: discord.Message, new_msg: discord.Message
-) -> bool:
-    """Return True if the edited message is the context message and the content was indeed modified."""
-    return new_msg.id == ctx.message.id and old_msg.content != new_msg.content
-
 
-def predicate_eval_emoji_reaction(
-    ctx: commands.Context, reaction: discord.Reaction, user: discord.User
-) -> bool:
-    """Return True if the reaction REEVAL_EMOJI was added by the context message author on this message."""
-    return (
-        reaction.message.id == ctx.message.id
-        and user.id == ctx.author.id
-        and str(reaction) == REEVAL_EMOJI
-    )
+async def setup(bot: Snakeboxed):
+    await bot.add_cog(Snekbox(bot))
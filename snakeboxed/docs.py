@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import re
+import time
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import aiohttp
+
+from snakeboxed.radix_trie import RadixTrie
+from snakeboxed.single_flight import SingleFlight
+
+DEFAULT_INVENTORIES = {"python": "https://docs.python.org/3/"}
+DEFAULT_PACKAGES = ("python",)
+DEFAULT_CACHE_DIR = "docs_cache"
+DEFAULT_CACHE_MAX_AGE = 7 * 24 * 60 * 60  # seconds
+
+INVENTORY_FILE_NAME = "objects.inv"
+INVENTORY_HEADER = b"# Sphinx inventory version 2"
+# name, domain:role, priority, uri, display name; the name can contain spaces
+INVENTORY_LINE_REGEX = re.compile(r"(.+?)\s+(\S+?:\S+)\s+(-?\d+)\s+(\S*)\s*(.*)")
+# the kinds of objects worth looking up, the rest are mostly section labels
+INDEXED_ROLES = ("py:", "std:term", "std:doc")
+
+MAX_RESULTS = 5
+MAX_FUZZY_DISTANCE = 2
+# fuzzy searches take milliseconds, so repeated searches are cached
+SEARCH_CACHE_SIZE = 256
+
+log = logging.getLogger(__name__)
+
+
+class DocsUnavailable(Exception):
+    """Raised when a package's inventory can't be loaded."""
+
+
+class DocsItem(NamedTuple):
+    name: str
+    role: str
+    url: str
+
+
+class DocsIndex:
+    """Symbols from one Sphinx inventory, indexed for exact, prefix and fuzzy lookup.
+
+    Each symbol is also indexed by the parts after each dot, so os.path.join is found
+    by searching for path.join or join. Keys are casefolded.
+    """
+
+    def __init__(self, project: str, version: str, items: List[DocsItem]):
+        self.project = project
+        self.version = version
+        self.items = items
+
+        # values are indexes into items, to keep the trie small
+        self.trie: RadixTrie[int] = RadixTrie()
+        for i, item in enumerate(items):
+            key = item.name.casefold()
+            self.trie.insert(key, i)
+            start = key.find(".")
+            while start != -1:
+                self.trie.insert(key[start + 1 :], i)
+                start = key.find(".", start + 1)
+
+        self.search_cache: OrderedDict[Tuple[str, int], List[DocsItem]] = OrderedDict()
+
+    @classmethod
+    def from_inventory(cls, data: bytes, base_url: str) -> "DocsIndex":
+        project, version, items = parse_inventory(data, base_url)
+        return cls(project, version, items)
+
+    def rank(self, key: str, indexes: Sequence[int]) -> List[DocsItem]:
+        """Return the items without duplicates, with symbols named exactly key first."""
+        items = [self.items[i] for i in dict.fromkeys(indexes)]
+        items.sort(key=lambda item: (item.name.casefold() != key, len(item.name)))
+        return items
+
+    def search(self, query: str, limit: int = MAX_RESULTS) -> List[DocsItem]:
+        """Return the items named query, or failing that the ones starting with it,
+        or failing that the closest ones within a few edits of it.
+        """
+        cache_key = (query.casefold(), limit)
+        results = self.search_cache.get(cache_key)
+        if results is not None:
+            self.search_cache.move_to_end(cache_key)
+            return results
+
+        results = self.find(*cache_key)
+        self.search_cache[cache_key] = results
+        if len(self.search_cache) > SEARCH_CACHE_SIZE:
+            self.search_cache.popitem(last=False)
+        return results
+
+    def find(self, key: str, limit: int) -> List[DocsItem]:
+        exact = self.trie.get(key)
+        if exact:
+            return self.rank(key, exact)[:limit]
+
+        prefixed = []
+        for _, indexes in self.trie.iter_prefix(key):
+            prefixed.extend(indexes)
+            if len(set(prefixed)) >= limit:
+                break
+        if prefixed:
+            return self.rank(key, prefixed)[:limit]
+
+        fuzzy = self.trie.search_fuzzy(key, MAX_FUZZY_DISTANCE)
+        indexes = [i for _, _, values in fuzzy for i in values]
+        return [self.items[i] for i in dict.fromkeys(indexes)][:limit]
+
+
+def parse_inventory(data: bytes, base_url: str) -> Tuple[str, str, List[DocsItem]]:
+    """Return the project, version and items of a version 2 Sphinx objects.inv file."""
+    lines = data.split(b"\n", 4)
+    if len(lines) < 5 or lines[0].rstrip() != INVENTORY_HEADER:
+        raise DocsUnavailable("not a version 2 Sphinx inventory")
+    project = lines[1].decode("utf_8").removeprefix("# Project: ").strip()
+    version = lines[2].decode("utf_8").removeprefix("# Version: ").strip()
+    try:
+        body = zlib.decompress(lines[4]).decode("utf_8")
+    except (zlib.error, UnicodeDecodeError) as error:
+        raise DocsUnavailable(f"couldn't decompress the inventory: {error}")
+
+    items = []
+    for line in body.splitlines():
+        match = INVENTORY_LINE_REGEX.fullmatch(line.rstrip())
+        if match is None:
+            continue
+        name, role, priority, uri, _ = match.groups()
+        if not role.startswith(INDEXED_ROLES) or priority == "-1":
+            continue
+        if uri.endswith("$"):
+            uri = uri[:-1] + name
+        items.append(DocsItem(name, role, base_url + uri))
+    return project, version, items
+
+
+class DocsSource(NamedTuple):
+    url: str
+    # a local objects.inv to use instead of fetching it
+    path: Optional[Path] = None
+
+
+class DocsLookup:
+    """Look up symbols in the docs of the configured packages.
+
+    Inventories are read from a local file if one is configured, otherwise fetched once
+    and cached on disk until they're cache_max_age seconds old.
+    Each package is only loaded the first time it's searched.
+    """
+
+    def __init__(
+        self,
+        http_session: aiohttp.ClientSession,
+        sources: Dict[str, DocsSource],
+        default_packages: Sequence[str] = DEFAULT_PACKAGES,
+        cache_dir: Path = Path(DEFAULT_CACHE_DIR),
+        cache_max_age: float = DEFAULT_CACHE_MAX_AGE,
+    ):
+        self.http_session = http_session
+        self.sources = sources
+        self.default_packages = list(default_packages)
+        self.cache_dir = cache_dir
+        self.cache_max_age = cache_max_age
+
+        self.indexes: Dict[str, DocsIndex] = {}
+        self.loads = SingleFlight()
+
+    @classmethod
+    def from_config(
+        cls, http_session: aiohttp.ClientSession, config: dict
+    ) -> "DocsLookup":
+        sources = {}
+        for package, source in config.get("inventories", DEFAULT_INVENTORIES).items():
+            if isinstance(source, str):
+                sources[package] = DocsSource(source)
+            else:
+                path = source.get("path")
+                sources[package] = DocsSource(
+                    source["url"], Path(path) if path is not None else None
+                )
+
+        return cls(
+            http_session,
+            sources,
+            default_packages=config.get("default", DEFAULT_PACKAGES),
+            cache_dir=Path(config.get("cache_dir", DEFAULT_CACHE_DIR)),
+            cache_max_age=config.get("cache_max_age", DEFAULT_CACHE_MAX_AGE),
+        )
+
+    async def get_index(self, package: str) -> DocsIndex:
+        """Return the index for a package, loading it if it's the first time it's needed."""
+        index = self.indexes.get(package)
+        if index is None:
+            index = await self.loads.run(package, lambda: self.load_index(package))
+        return index
+
+    async def load_index(self, package: str) -> DocsIndex:
+        source = self.sources[package]
+        start = time.perf_counter()
+
+        data = await self.read_inventory(package, source)
+        index = await asyncio.to_thread(DocsIndex.from_inventory, data, source.url)
+        self.indexes[package] = index
+
+        log.info(
+            f"Loaded {len(index.items)} symbols from the {package} docs "
+            f"in {time.perf_counter() - start:.3f}s"
+        )
+        return index
+
+    async def read_inventory(self, package: str, source: DocsSource) -> bytes:
+        if source.path is not None:
+            try:
+                return await asyncio.to_thread(source.path.read_bytes)
+            except OSError as error:
+                raise DocsUnavailable(f"couldn't read the {package} inventory: {error}")
+
+        cache_path = self.cache_dir / f"{package}.inv"
+        cached = cache_path.is_file()
+        if cached and time.time() - cache_path.stat().st_mtime < self.cache_max_age:
+            return await asyncio.to_thread(cache_path.read_bytes)
+
+        try:
+            data = await self.fetch_inventory(source.url)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            if cached:
+                log.warning(
+                    f"Couldn't refresh the {package} inventory, using the cached one: {error}"
+                )
+                return await asyncio.to_thread(cache_path.read_bytes)
+            raise DocsUnavailable(f"couldn't fetch the {package} inventory: {error}")
+
+        await asyncio.to_thread(self.write_cache, cache_path, data)
+        return data
+
+    async def fetch_inventory(self, url: str) -> bytes:
+        log.info(f"Fetching the inventory from {url}")
+        async with self.http_session.get(
+            url + INVENTORY_FILE_NAME, raise_for_status=True
+        ) as resp:
+            return await resp.read()
+
+    @staticmethod
+    def write_cache(cache_path: Path, data: bytes):
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # written to the side first so a half written cache is never read
+        temp_path = cache_path.with_suffix(".tmp")
+        temp_path.write_bytes(data)
+        temp_path.replace(cache_path)
+
+    async def search(
+        self, query: str, packages: Optional[Sequence[str]] = None
+    ) -> List[Tuple[str, DocsItem]]:
+        """Search the packages' docs, or the default packages' docs,
+        and return each result with its package.
+        """
+        results = []
+        for package in packages or self.default_packages:
+            index = await self.get_index(package)
+            results.extend((package, item) for item in index.search(query))
+        return results[:MAX_RESULTS]
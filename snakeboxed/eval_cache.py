@@ -0,0 +1,119 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Iterable, NamedTuple, Optional
+
+import discord
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 16 * (10**6)  # 16MB
+DEFAULT_TTL = 10 * 60  # seconds
+
+# rough size of a cache entry apart from the output itself
+ENTRY_OVERHEAD_BYTES = 200
+
+
+class CacheEntry(NamedTuple):
+    results: dict
+    size: int
+    expires: float
+
+
+def code_key(code: str) -> str:
+    """Return the cache key for prepared code."""
+    return hashlib.sha256(code.encode("utf_8", errors="surrogatepass")).hexdigest()
+
+
+class EvalCache:
+    """LRU cache of eval results with a time to live, keyed by a hash of the prepared code.
+
+    Bounded by both entry count and the total size of the cached output.
+    Only successful results are stored, since those are the most likely to be deterministic.
+    Only used in guilds that opted in.
+    """
+
+    def __init__(
+        self,
+        guilds: Iterable[int] = (),
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl: float = DEFAULT_TTL,
+    ):
+        self.guilds = set(guilds)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self.entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, config: dict) -> "EvalCache":
+        return cls(
+            guilds=config.get("guilds", ()),
+            max_entries=config.get("max_entries", DEFAULT_MAX_ENTRIES),
+            max_bytes=config.get("max_bytes", DEFAULT_MAX_BYTES),
+            ttl=config.get("ttl", DEFAULT_TTL),
+        )
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def enabled_for(self, guild: Optional[discord.Guild]) -> bool:
+        return guild is not None and guild.id in self.guilds
+
+    @staticmethod
+    def is_cacheable(results: dict) -> bool:
+        """Return True if the results look deterministic enough to reuse.
+
+        A return code of 0 rules out errors, timeouts and running out of memory.
+        """
+        return results.get("returncode") == 0
+
+    def get(self, code: str) -> Optional[dict]:
+        """Return the cached results for code, or None if there are none."""
+        key = code_key(code)
+        entry = self.entries.get(key)
+
+        if entry is not None and entry.expires <= time.monotonic():
+            self._remove(key)
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return dict(entry.results)
+
+    def put(self, code: str, results: dict):
+        """Store the results for code if they're cacheable and fit in the cache."""
+        if not self.is_cacheable(results):
+            return
+
+        size = len(results["stdout"].encode("utf_8", errors="surrogatepass"))
+        size += ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+
+        key = code_key(code)
+        if key in self.entries:
+            self._remove(key)
+
+        self.entries[key] = CacheEntry(dict(results), size, time.monotonic() + self.ttl)
+        self.size += size
+
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key)
+        self.size -= entry.size
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -0,0 +1,66 @@
+import asyncio
+from typing import Awaitable, Optional, TypeVar
+
+DEFAULT_DEADLINE = 60  # seconds
+
+T = TypeVar("T")
+
+
+class JobCancelled(Exception):
+    """Raised when an eval job is cancelled before it finishes, with the reason as its message."""
+
+
+class EvalJob:
+    """A user's eval job in progress, with the time it has to finish by and the task running it.
+
+    The deadline is in event loop time and covers the whole job, waiting in the queue included.
+    """
+
+    def __init__(self, author_id: int, message_id: int, deadline: float):
+        self.author_id = author_id
+        self.message_id = message_id
+        self.deadline = deadline
+
+        self.task: Optional[asyncio.Task] = None
+        self.cancel_reason: Optional[str] = None
+
+    @classmethod
+    def start(
+        cls, author_id: int, message_id: int, timeout: float = DEFAULT_DEADLINE
+    ) -> "EvalJob":
+        deadline = asyncio.get_running_loop().time() + timeout
+        return cls(author_id, message_id, deadline)
+
+    @property
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - asyncio.get_running_loop().time())
+
+    async def run(self, coroutine: Awaitable[T]) -> T:
+        """Run the job in its own task and return its result.
+
+        Raises asyncio.TimeoutError if the deadline passes first,
+        and JobCancelled if the job is cancelled.
+        """
+        self.task = asyncio.ensure_future(self._run_until_deadline(coroutine))
+        try:
+            return await self.task
+        except asyncio.CancelledError:
+            # only the job was cancelled, not whatever is waiting for it
+            if self.cancel_reason is None:
+                raise
+            raise JobCancelled(self.cancel_reason) from None
+
+    async def _run_until_deadline(self, coroutine: Awaitable[T]) -> T:
+        async with asyncio.timeout_at(self.deadline):
+            return await coroutine
+
+    def cancel(self, reason: str) -> bool:
+        """Cancel the job right away, including any request it's waiting for.
+
+        Return False if it isn't running.
+        """
+        if self.task is None or self.task.done():
+            return False
+        self.cancel_reason = reason
+        self.task.cancel()
+        return True
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+DEFAULT_PATH = "guild_settings.sqlite3"
+
+CHANNEL = "channel"
+ROLE = "role"
+USER = "user"
+RULE_KINDS = (CHANNEL, ROLE, USER)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS eval_rules (
+    guild_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    target_id INTEGER NOT NULL,
+    allow INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, kind, target_id)
+) WITHOUT ROWID
+"""
+
+log = logging.getLogger(__name__)
+
+
+class EvalRules:
+    """One guild's rules for where eval is allowed, compiled into sets of ids.
+
+    The most specific rule wins: a rule for the user, then for any of their roles,
+    then for the channel, its parent channel or its category. An allowed user or role can
+    use eval in any channel, and a denied role wins over an allowed one.
+    Once something of a kind is allowed, everything of that kind that isn't is denied.
+    """
+
+    __slots__ = (
+        "allowed_users",
+        "denied_users",
+        "allowed_roles",
+        "denied_roles",
+        "allowed_channels",
+        "denied_channels",
+    )
+
+    def __init__(self, rules: Dict[Tuple[str, int], bool]):
+        def ids(kind: str, allow: bool) -> FrozenSet[int]:
+            return frozenset(
+                target_id
+                for (rule_kind, target_id), rule_allow in rules.items()
+                if rule_kind == kind and rule_allow == allow
+            )
+
+        self.allowed_users = ids(USER, True)
+        self.denied_users = ids(USER, False)
+        self.allowed_roles = ids(ROLE, True)
+        self.denied_roles = ids(ROLE, False)
+        self.allowed_channels = ids(CHANNEL, True)
+        self.denied_channels = ids(CHANNEL, False)
+
+    def allows(
+        self, user_id: int, role_ids: Iterable[int], channel_ids: Iterable[int]
+    ) -> bool:
+        if user_id in self.denied_users:
+            return False
+        if user_id in self.allowed_users:
+            return True
+
+        if self.denied_roles or self.allowed_roles:
+            role_ids = frozenset(role_ids)
+            if not self.denied_roles.isdisjoint(role_ids):
+                return False
+            if not self.allowed_roles.isdisjoint(role_ids):
+                return True
+            if self.allowed_roles:
+                return False
+
+        if self.denied_channels or self.allowed_channels:
+            channel_ids = frozenset(channel_ids)
+            if not self.denied_channels.isdisjoint(channel_ids):
+                return False
+            if self.allowed_channels and self.allowed_channels.isdisjoint(channel_ids):
+                return False
+
+        return True
+
+
+# shared by every guild without rules
+NO_RULES = EvalRules({})
+
+
+class GuildSettings:
+    """Per-guild settings, stored in SQLite and kept in memory.
+
+    Every guild's rules are read once when the store is opened, and changes are written through.
+    A guild's compiled rules are only rebuilt when its rules change, so looking them up
+    for a message is a dict lookup no matter how many guilds there are.
+    Each guild is only on one shard, so cluster processes sharing the file don't need to
+    tell each other about changes.
+    """
+
+    def __init__(self, path: Path = Path(DEFAULT_PATH)):
+        self.path = path
+        self.connection: Optional[sqlite3.Connection] = None
+        # writes run in threads, one at a time
+        self.write_lock = asyncio.Lock()
+
+        self.rules: Dict[int, Dict[Tuple[str, int], bool]] = {}
+        self.compiled: Dict[int, EvalRules] = {}
+
+    @classmethod
+    def from_config(cls, config: dict) -> "GuildSettings":
+        return cls(Path(config.get("path", DEFAULT_PATH)))
+
+    async def open(self):
+        start = time.perf_counter()
+        await asyncio.to_thread(self._open)
+        log.info(
+            f"Loaded settings for {len(self.rules)} guilds "
+            f"in {time.perf_counter() - start:.3f}s"
+        )
+
+    def _open(self):
+        # only used from one thread at a time
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(SCHEMA)
+        rows = self.connection.execute(
+            "SELECT guild_id, kind, target_id, allow FROM eval_rules"
+        )
+        for guild_id, kind, target_id, allow in rows:
+            self.rules.setdefault(guild_id, {})[kind, target_id] = bool(allow)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def eval_rules(self, guild_id: int) -> EvalRules:
+        """Return a guild's rules for where eval is allowed, compiling them if they changed."""
+        compiled = self.compiled.get(guild_id)
+        if compiled is None:
+            rules = self.rules.get(guild_id)
+            compiled = EvalRules(rules) if rules else NO_RULES
+            self.compiled[guild_id] = compiled
+        return compiled
+
+    async def set_eval_rule(
+        self, guild_id: int, kind: str, target_id: int, allow: Optional[bool]
+    ):
+        """Allow or deny eval for a channel, role or user in a guild, or remove the rule for it
+        if allow is None.
+        """
+        if kind not in RULE_KINDS:
+            raise ValueError(f"unknown kind of eval rule: {kind}")
+
+        if allow is None:
+            query = "DELETE FROM eval_rules WHERE guild_id = ? AND kind = ? AND target_id = ?"
+            parameters = (guild_id, kind, target_id)
+        else:
+            query = "INSERT OR REPLACE INTO eval_rules VALUES (?, ?, ?, ?)"
+            parameters = (guild_id, kind, target_id, int(allow))
+        await self.write(query, parameters)
+
+        rules = self.rules.setdefault(guild_id, {})
+        if allow is None:
+            rules.pop((kind, target_id), None)
+        else:
+            rules[kind, target_id] = allow
+        if not rules:
+            del self.rules[guild_id]
+        self.compiled.pop(guild_id, None)
+
+    async def clear_eval_rules(self, guild_id: int):
+        await self.write("DELETE FROM eval_rules WHERE guild_id = ?", (guild_id,))
+        self.rules.pop(guild_id, None)
+        self.compiled.pop(guild_id, None)
+
+    async def write(self, query: str, parameters: tuple):
+        async with self.write_lock:
+            await asyncio.to_thread(self._write, query, parameters)
+
+    def _write(self, query: str, parameters: tuple):
+        with self.connection:
+            self.connection.execute(query, parameters)
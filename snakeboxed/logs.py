@@ -0,0 +1,111 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_LOG_PATH = Path("info.log")
+DEFAULT_LEVEL = "INFO"
+DEFAULT_MAX_BYTES = 10 * (10**6)  # 10MB
+DEFAULT_BACKUP_COUNT = 5
+DEFAULT_QUEUE_SIZE = 10_000
+DEFAULT_MAX_CODE_CHARS = 500
+DEFAULT_CODE_SAMPLE_RATE = 1.0
+
+# submitted code is logged here, so it can have its own level
+CODE_LOGGER_NAME = "snakeboxed.code"
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue records for a background thread to write, dropping them if the queue is full.
+
+    Keeps the event loop from ever waiting on the disk.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class CodeSampler:
+    """Shorten submitted code before it's logged."""
+
+    def __init__(
+        self,
+        max_chars: int = DEFAULT_MAX_CODE_CHARS,
+        sample_rate: float = DEFAULT_CODE_SAMPLE_RATE,
+    ):
+        self.max_chars = max_chars
+        self.sample_rate = sample_rate
+
+    def excerpt(self, code: Optional[str]) -> str:
+        """Return the code truncated to max_chars, or just its length if it isn't sampled."""
+        if code is None:
+            return str(code)
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return f"[{len(code)} characters, not sampled]"
+        if len(code) > self.max_chars:
+            return f"{code[:self.max_chars]}\n[... {len(code) - self.max_chars} more characters]"
+        return code
+
+
+CODE_SAMPLER = CodeSampler()
+
+
+def code_excerpt(code: Optional[str]) -> str:
+    return CODE_SAMPLER.excerpt(code)
+
+
+def setup_logging(
+    config: dict, log_path: Optional[Path] = None
+) -> DroppingQueueHandler:
+    """Log to stdout and a rotating file through a queue written by a background thread.
+
+    Set up from the [logging] config section, including levels for each logger.
+    """
+    if log_path is None:
+        log_path = Path(config.get("path", DEFAULT_LOG_PATH))
+
+    formatter = logging.Formatter(logging.BASIC_FORMAT)
+    stream_handler = logging.StreamHandler(stream=sys.stdout)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_path,
+        maxBytes=config.get("max_bytes", DEFAULT_MAX_BYTES),
+        backupCount=config.get("backup_count", DEFAULT_BACKUP_COUNT),
+        encoding="utf_8",
+    )
+    for handler in (stream_handler, file_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=config.get("queue_size", DEFAULT_QUEUE_SIZE))
+    queue_handler = DroppingQueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(
+        log_queue, stream_handler, file_handler, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+        handler.close()
+    # records are formatted by the queue handler on the thread that logs them, so their
+    # arguments can't change before they're written, only writing is left to the background thread
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(config.get("level", DEFAULT_LEVEL))
+    for logger_name, level in config.get("levels", {}).items():
+        logging.getLogger(logger_name).setLevel(level)
+
+    CODE_SAMPLER.max_chars = config.get("max_code_chars", DEFAULT_MAX_CODE_CHARS)
+    CODE_SAMPLER.sample_rate = config.get("code_sample_rate", DEFAULT_CODE_SAMPLE_RATE)
+
+    return queue_handler
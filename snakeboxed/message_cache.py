@@ -0,0 +1,101 @@
+import re
+from collections import OrderedDict
+from typing import Optional
+
+import discord
+
+from snakeboxed import metrics
+from snakeboxed.single_flight import SingleFlight
+
+DEFAULT_MAX_MESSAGES = 1000
+
+MESSAGE_LINK_REGEX = re.compile(
+    r"<?https?://(?:(?:ptb|canary|www)\.)?discord(?:app)?\.com/channels/"
+    r"(?P<guild_id>[0-9]{15,20}|@me)/(?P<channel_id>[0-9]{15,20})/(?P<message_id>[0-9]{15,20})/?>?"
+)
+
+
+class MessageReferenceError(Exception):
+    """Raised when a linked or replied to message can't be used as eval input.
+    The message is shown to the user.
+    """
+
+
+class CachedMessage:
+    __slots__ = ("id", "channel_id", "content")
+
+    def __init__(self, message_id: int, channel_id: int, content: str):
+        self.id = message_id
+        self.channel_id = channel_id
+        self.content = content
+
+    @classmethod
+    def from_message(cls, message: discord.Message) -> "CachedMessage":
+        return cls(message.id, message.channel.id, message.content)
+
+
+class MessageCache:
+    """The content of recent messages, kept up to date from gateway events,
+    so messages used as eval input don't have to be fetched.
+
+    Holds up to max_messages, dropping the least recently used. Messages that aren't cached
+    are fetched, and concurrent fetches of the same message share one request.
+    """
+
+    def __init__(self, max_messages: int = DEFAULT_MAX_MESSAGES):
+        self.max_messages = max_messages
+        self.messages: OrderedDict[int, CachedMessage] = OrderedDict()
+        self.fetches = SingleFlight()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "MessageCache":
+        return cls(max_messages=config.get("max_messages", DEFAULT_MAX_MESSAGES))
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def get(self, message_id: int) -> Optional[CachedMessage]:
+        cached = self.messages.get(message_id)
+        if cached is not None:
+            self.messages.move_to_end(message_id)
+        return cached
+
+    def put(self, cached: CachedMessage):
+        if self.max_messages <= 0:
+            return
+        self.messages[cached.id] = cached
+        self.messages.move_to_end(cached.id)
+        while len(self.messages) > self.max_messages:
+            self.messages.popitem(last=False)
+
+    def update(self, message_id: int, content: str):
+        """Change the content of a cached message, messages that aren't cached are left out."""
+        cached = self.messages.get(message_id)
+        if cached is not None:
+            cached.content = content
+
+    def remove(self, message_id: int):
+        self.messages.pop(message_id, None)
+
+    async def fetch(
+        self, channel: discord.abc.Messageable, message_id: int
+    ) -> CachedMessage:
+        """Return a message from the cache, or fetch it from the channel and cache it.
+
+        Raises discord.NotFound or discord.Forbidden if it can't be fetched.
+        """
+        cached = self.get(message_id)
+        if cached is not None:
+            metrics.MESSAGE_CACHE_LOOKUPS.inc(result="hit")
+            return cached
+
+        metrics.MESSAGE_CACHE_LOOKUPS.inc(result="fetch")
+        message = await self.fetches.run(
+            message_id, lambda: channel.fetch_message(message_id)
+        )
+        # an edit seen while it was being fetched is newer
+        cached = self.get(message_id)
+        if cached is None:
+            cached = CachedMessage.from_message(message)
+            self.put(cached)
+        return cached
@@ -0,0 +1,301 @@
+import abc
+import bisect
+import contextlib
+import logging
+import math
+import time
+from collections import deque
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from aiohttp import web
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 9100
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# observations kept by histograms that track recent values
+RECENT_OBSERVATIONS = 500
+
+
+log = logging.getLogger(__name__)
+
+
+def format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def quantile(values: Iterable[float], q: float) -> Optional[float]:
+    """Return the q quantile of the values by the nearest rank, or None if there are none."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{name}="{escape_label_value(value)}"' for name, value in labels.items()
+    )
+    return f"{{{pairs}}}"
+
+
+class Metric(abc.ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[Tuple[str, Dict[str, str], float]]:
+        """Yield the name, labels and value of each sample."""
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """A count that only goes up, optionally split by labels."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation)
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        if not self.labelnames:
+            self.values[()] = 0
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self.values.get(tuple(str(labels[name]) for name in self.labelnames), 0)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield f"{self.name}_total", dict(zip(self.labelnames, key)), value
+
+
+class Gauge(Metric):
+    """A value that can go up and down, read from a function when scraped."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.function: Optional[Callable[[], float]] = None
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, {}, self.function()
+
+
+class Histogram(Metric):
+    """Counts of observed values in cumulative buckets, with their sum.
+
+    Optionally also keeps the last few observations, for exact quantiles of recent values.
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        recent: int = 0,
+    ):
+        super().__init__(name, documentation)
+        self.buckets: List[float] = sorted(buckets) + [math.inf]
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.recent: Optional[Deque[float]] = deque(maxlen=recent) if recent else None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if self.recent is not None:
+            self.recent.append(value)
+
+    def recent_quantile(self, q: float) -> Optional[float]:
+        return quantile(self.recent or (), q)
+
+    @contextlib.contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe the time taken by the body of the with statement in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{self.name}_bucket", {"le": format_value(bound)}, cumulative
+        yield f"{self.name}_sum", {}, self.sum
+        yield f"{self.name}_count", {}, self.count
+
+
+class Registry:
+    """Metrics in the order they are rendered."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+POST_EVAL_SECONDS = REGISTRY.register(
+    Histogram(
+        "snakeboxed_post_eval_seconds",
+        "Time taken by snekbox to evaluate a job.",
+        recent=RECENT_OBSERVATIONS,
+    )
+)
+FORMAT_OUTPUT_SECONDS = REGISTRY.register(
+    Histogram(
+        "snakeboxed_format_output_seconds",
+        "Time taken to format eval output for Discord.",
+    )
+)
+DISCORD_SEND_SECONDS = REGISTRY.register(
+    Histogram(
+        "snakeboxed_discord_send_seconds", "Time taken to send eval results to Discord."
+    )
+)
+EVAL_RESULTS = REGISTRY.register(
+    Counter(
+        "snakeboxed_eval_results",
+        "Finished eval jobs by result category.",
+        labelnames=("category",),
+    )
+)
+EVAL_COALESCED = REGISTRY.register(
+    Counter(
+        "snakeboxed_eval_coalesced",
+        "Eval jobs that shared the snekbox run of an identical job already in progress.",
+    )
+)
+EVAL_RATE_LIMITED = REGISTRY.register(
+    Counter(
+        "snakeboxed_eval_rate_limited",
+        "Eval jobs rejected by a rate limit, by the scope of the limit.",
+        labelnames=("scope",),
+    )
+)
+OUTBOUND_MERGED = REGISTRY.register(
+    Counter(
+        "snakeboxed_outbound_merged",
+        "Discord requests that weren't sent because a later one for the same thing replaced them.",
+    )
+)
+MESSAGE_CACHE_LOOKUPS = REGISTRY.register(
+    Counter(
+        "snakeboxed_message_cache_lookups",
+        "Messages used as eval input, by whether they were cached or had to be fetched.",
+        labelnames=("result",),
+    )
+)
+EVAL_JOBS = REGISTRY.register(
+    Gauge("snakeboxed_eval_jobs", "Eval jobs currently running.")
+)
+EVAL_QUEUE_DEPTH = REGISTRY.register(
+    Gauge("snakeboxed_eval_queue_depth", "Eval jobs waiting for a free slot.")
+)
+EVENT_LOOP_LAG_SECONDS = REGISTRY.register(
+    Gauge(
+        "snakeboxed_event_loop_lag_seconds",
+        "How late the event loop last woke up a task sleeping for a fixed interval.",
+    )
+)
+GATEWAY_LATENCY_SECONDS = REGISTRY.register(
+    Gauge(
+        "snakeboxed_gateway_latency_seconds",
+        "Latency between a gateway heartbeat and its acknowledgement.",
+    )
+)
+
+
+class MetricsServer:
+    """Local HTTP server for the /metrics endpoint, in the Prometheus text format."""
+
+    def __init__(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        registry: Registry = REGISTRY,
+    ):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.runner: Optional[web.AppRunner] = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> "MetricsServer":
+        return cls(
+            host=config.get("host", DEFAULT_HOST), port=config.get("port", DEFAULT_PORT)
+        )
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=self.registry.render().encode("utf_8"),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        log.info(f"serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, TypeVar
+
+from snakeboxed import metrics
+from snakeboxed.rate_limit import BucketLimit, RateLimited, RateLimiter
+
+# Discord allows about 5 messages every 5 seconds in a channel
+DEFAULT_REQUESTS = 5
+DEFAULT_PER = 5  # seconds
+
+CHANNEL = "channel"
+
+T = TypeVar("T")
+
+log = logging.getLogger(__name__)
+
+
+class Operation:
+    __slots__ = ("function", "futures")
+
+    def __init__(self, function: Callable[[], Awaitable], future: asyncio.Future):
+        self.function = function
+        self.futures: List[asyncio.Future] = [future]
+
+
+class ChannelQueue:
+    def __init__(self):
+        # operations in the order they were first queued, by merge key
+        self.pending: OrderedDict[Hashable, Operation] = OrderedDict()
+        self.worker: Optional[asyncio.Task] = None
+
+
+class OutboundQueue:
+    """Send the bot's messages, edits and reactions one at a time per channel,
+    pacing each channel to stay under Discord's rate limits instead of waiting for a 429.
+
+    Requests with the same key that are still waiting are merged, only the latest one is sent,
+    and everyone waiting for them gets its result. For example, only the last of several edits
+    to a message is sent. Each channel's worker only runs while it has requests.
+    """
+
+    def __init__(self, limit: BucketLimit):
+        self.rate_limiter = RateLimiter({CHANNEL: limit})
+        self.channels: Dict[int, ChannelQueue] = {}
+
+    @classmethod
+    def from_config(cls, config: dict) -> "OutboundQueue":
+        requests = config.get("requests", DEFAULT_REQUESTS)
+        return cls(BucketLimit(requests, requests / config.get("per", DEFAULT_PER)))
+
+    @property
+    def pending(self) -> int:
+        return sum(len(queue.pending) for queue in self.channels.values())
+
+    async def run(
+        self,
+        channel_id: int,
+        key: Optional[Hashable],
+        function: Callable[[], Awaitable[T]],
+    ) -> T:
+        """Queue a request in a channel and return its result once it's been sent.
+
+        A waiting request with the same key is replaced by this one, a key of None is never merged.
+        """
+        queue = self.channels.get(channel_id)
+        if queue is None:
+            queue = self.channels[channel_id] = ChannelQueue()
+
+        future = asyncio.get_running_loop().create_future()
+        if key is None:
+            key = object()
+        operation = queue.pending.get(key)
+        if operation is None:
+            queue.pending[key] = Operation(function, future)
+        else:
+            operation.function = function
+            operation.futures.append(future)
+            metrics.OUTBOUND_MERGED.inc()
+
+        if queue.worker is None:
+            queue.worker = asyncio.create_task(self.work(channel_id, queue))
+        return await future
+
+    async def work(self, channel_id: int, queue: ChannelQueue):
+        futures = []
+        try:
+            while queue.pending:
+                # requests queued while waiting can still be merged
+                await self.wait_for_turn(channel_id)
+                _, operation = queue.pending.popitem(last=False)
+                futures = [future for future in operation.futures if not future.done()]
+                if not futures:
+                    # everyone waiting for it was cancelled
+                    continue
+
+                try:
+                    result = await operation.function()
+                except Exception as error:
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(error)
+                else:
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(result)
+        except asyncio.CancelledError:
+            # the bot is closing, so nothing else will be sent
+            for operation in queue.pending.values():
+                futures.extend(operation.futures)
+            queue.pending.clear()
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            queue.worker = None
+            if self.channels.get(channel_id) is queue and not queue.pending:
+                del self.channels[channel_id]
+
+    async def wait_for_turn(self, channel_id: int):
+        while True:
+            try:
+                return self.rate_limiter.acquire(((CHANNEL, channel_id),))
+            except RateLimited as error:
+                log.debug(f"Pacing channel {channel_id} for {error.retry_after:.2f}s")
+                await asyncio.sleep(error.retry_after)
@@ -0,0 +1,194 @@
+import asyncio
+import linecache
+import logging
+import time
+import tracemalloc
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from snakeboxed.metrics import quantile
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+DEFAULT_INTERVAL = 0.5  # seconds
+# samples kept, a minute at the default interval
+DEFAULT_WINDOW = 120
+# frames of traceback kept for each allocation, more costs more memory and time
+DEFAULT_TRACEMALLOC_FRAMES = 1
+DEFAULT_TOP = 10
+# allocations made by tracemalloc and the import system aren't the bot's
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+log = logging.getLogger(__name__)
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Return the resident set size of this process, or None if it isn't known (only on Linux)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * resource.getpagesize()
+
+
+def peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LoopMonitor:
+    """Sample event loop lag in the background by timing how late a fixed sleep wakes up,
+    and the CPU time used by the process alongside it.
+
+    Lag means something kept the loop busy, a slow callback or blocking call,
+    rather than waiting on snekbox or Discord.
+    """
+
+    def __init__(
+        self, interval: float = DEFAULT_INTERVAL, window: int = DEFAULT_WINDOW
+    ):
+        self.interval = interval
+        self.lags: Deque[float] = deque(maxlen=window)
+        # (wall clock, CPU time) at each sample
+        self.cpu_samples: Deque[Tuple[float, float]] = deque(maxlen=window)
+        self.task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> "LoopMonitor":
+        return cls(
+            interval=config.get("interval", DEFAULT_INTERVAL),
+            window=config.get("window", DEFAULT_WINDOW),
+        )
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - start - self.interval))
+            self.cpu_samples.append((time.perf_counter(), time.process_time()))
+
+    @property
+    def last_lag(self) -> float:
+        return self.lags[-1] if self.lags else 0.0
+
+    def lag_quantile(self, q: float) -> Optional[float]:
+        return quantile(self.lags, q)
+
+    @property
+    def window_seconds(self) -> float:
+        if len(self.cpu_samples) < 2:
+            return 0.0
+        return self.cpu_samples[-1][0] - self.cpu_samples[0][0]
+
+    def cpu_percent(self) -> Optional[float]:
+        """Return the CPU used by the process over the window, as a percentage of one core."""
+        if len(self.cpu_samples) < 2:
+            return None
+        (first_wall, first_cpu), (last_wall, last_cpu) = (
+            self.cpu_samples[0],
+            self.cpu_samples[-1],
+        )
+        return 100 * (last_cpu - first_cpu) / (last_wall - first_wall)
+
+    @staticmethod
+    def slow_callback_threshold() -> Optional[float]:
+        """Return the duration over which callbacks are logged, or None if they aren't."""
+        loop = asyncio.get_running_loop()
+        return loop.slow_callback_duration if loop.get_debug() else None
+
+    @staticmethod
+    def log_slow_callbacks(threshold: Optional[float]):
+        """Log callbacks that run for longer than threshold seconds, or stop if it's None.
+
+        Uses asyncio's debug mode, which logs slow callbacks to the asyncio logger,
+        and also adds some overhead to every task, so it's meant to be turned on while investigating.
+        """
+        loop = asyncio.get_running_loop()
+        if threshold is None:
+            loop.set_debug(False)
+            log.info("Stopped logging slow callbacks")
+        else:
+            loop.slow_callback_duration = threshold
+            loop.set_debug(True)
+            log.info(f"Logging callbacks slower than {threshold:.3f}s")
+
+
+class MemorySnapshots:
+    """Take tracemalloc snapshots on demand, comparing each one to the one before it,
+    to find what's growing in a running bot.
+
+    Tracing allocations slows the bot down and uses memory of its own,
+    so it's only on between start and stop.
+    """
+
+    def __init__(self):
+        self.previous: Optional[tracemalloc.Snapshot] = None
+
+    @staticmethod
+    def is_tracing() -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = DEFAULT_TRACEMALLOC_FRAMES):
+        tracemalloc.start(frames)
+        self.previous = None
+        log.info(f"Started tracing allocations with {frames} frames")
+
+    def stop(self):
+        tracemalloc.stop()
+        self.previous = None
+        log.info("Stopped tracing allocations")
+
+    async def take(self, top: int = DEFAULT_TOP) -> List[str]:
+        """Take a snapshot and return a line for each of the top lines of code by memory,
+        with how much it's grown since the last snapshot if there was one.
+
+        Snapshots are taken and compared in a worker thread, they can take a while.
+        """
+        snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+        snapshot = snapshot.filter_traces(SNAPSHOT_FILTERS)
+        if self.previous is None:
+            statistics = await asyncio.to_thread(snapshot.statistics, "lineno")
+            lines = [
+                f"{location(stat.traceback)}: {stat.size / 1024:.1f}KiB in {stat.count} blocks"
+                for stat in statistics[:top]
+            ]
+        else:
+            statistics = await asyncio.to_thread(
+                snapshot.compare_to, self.previous, "lineno"
+            )
+            lines = [
+                f"{location(stat.traceback)}: {stat.size / 1024:.1f}KiB "
+                f"({stat.size_diff / 1024:+.1f}KiB), {stat.count} blocks ({stat.count_diff:+d})"
+                for stat in statistics[:top]
+            ]
+        self.previous = snapshot
+        return lines
+
+
+def location(traceback: tracemalloc.Traceback) -> str:
+    """Return where an allocation was made, shortened to the last two parts of the path."""
+    # the most recent frame is last
+    frame = traceback[-1]
+    path = "/".join(frame.filename.replace("\\", "/").split("/")[-2:])
+    return f"{path}:{frame.lineno}"
@@ -0,0 +1,187 @@
+import heapq
+import itertools
+from typing import Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class RadixNode(Generic[T]):
+    __slots__ = ("label", "children", "values")
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        # keyed by the first character of each child's label
+        self.children: Dict[str, "RadixNode[T]"] = {}
+        self.values: Optional[List[T]] = None
+
+
+def next_edit_band(
+    band: List[int], char: str, word: str, depth: int, max_distance: int
+) -> List[int]:
+    """Return the next band of the Levenshtein distance table between word and a key,
+    after char at position depth (from 1) of the key.
+
+    A band holds the 2 * max_distance + 1 cells around the diagonal of its row, the only ones
+    that can be within max_distance. Distances over max_distance are capped at max_distance + 1.
+    """
+    cap = max_distance + 1
+    new_band = []
+    left = cap
+    # cell t is in column depth + t - max_distance, and the previous band is one column behind
+    for t, j in enumerate(range(depth - max_distance, depth + max_distance + 1)):
+        if j < 0 or j > len(word):
+            cell = cap
+        elif j == 0:
+            cell = min(depth, cap)
+        else:
+            cell = band[t] + (word[j - 1] != char)
+            if t + 1 < len(band) and band[t + 1] < cell:
+                cell = band[t + 1] + 1
+            if left + 1 < cell:
+                cell = left + 1
+            if cell > cap:
+                cell = cap
+        new_band.append(cell)
+        left = cell
+    return new_band
+
+
+class RadixTrie(Generic[T]):
+    """Map string keys to lists of values, with edges labelled by whole runs of characters.
+
+    Compressing runs of single-child nodes keeps the node count to at most twice the key count,
+    so exact and prefix lookups stay fast without a node per character.
+    """
+
+    def __init__(self):
+        self.root: RadixNode[T] = RadixNode()
+        self.keys = 0
+
+    def __len__(self) -> int:
+        return self.keys
+
+    def insert(self, key: str, value: T):
+        node = self.root
+        i = 0
+        while i < len(key):
+            child = node.children.get(key[i])
+            if child is None:
+                child = RadixNode(key[i:])
+                node.children[key[i]] = child
+                node = child
+                break
+
+            label = child.label
+            common = 1
+            while (
+                common < len(label)
+                and i + common < len(key)
+                and label[common] == key[i + common]
+            ):
+                common += 1
+            if common < len(label):
+                # split the edge where the key leaves it
+                middle = RadixNode(label[:common])
+                child.label = label[common:]
+                middle.children[child.label[0]] = child
+                node.children[key[i]] = middle
+                child = middle
+            node = child
+            i += common
+
+        if node.values is None:
+            node.values = []
+            self.keys += 1
+        node.values.append(value)
+
+    def find_prefix(self, prefix: str) -> Optional[Tuple[RadixNode[T], str]]:
+        """Return the node where keys starting with prefix begin and the key up to that node,
+        or None if no key starts with prefix.
+        """
+        node = self.root
+        path = ""
+        i = 0
+        while i < len(prefix):
+            child = node.children.get(prefix[i])
+            if child is None:
+                return None
+            rest = prefix[i : i + len(child.label)]
+            if not child.label.startswith(rest):
+                return None
+            node = child
+            path += child.label
+            i += len(child.label)
+        return node, path
+
+    def get(self, key: str) -> List[T]:
+        found = self.find_prefix(key)
+        if found is None:
+            return []
+        node, path = found
+        if path != key or node.values is None:
+            return []
+        return node.values
+
+    def iter_prefix(self, prefix: str) -> Iterator[Tuple[str, List[T]]]:
+        """Yield the keys starting with prefix and their values, shortest keys first."""
+        found = self.find_prefix(prefix)
+        if found is None:
+            return
+        counter = itertools.count()
+        heap = [(len(found[1]), found[1], next(counter), found[0])]
+        while heap:
+            _, path, _, node = heapq.heappop(heap)
+            if node.values is not None:
+                yield path, node.values
+            for child in node.children.values():
+                child_path = path + child.label
+                heapq.heappush(
+                    heap, (len(child_path), child_path, next(counter), child)
+                )
+
+    def search_within(
+        self, word: str, max_distance: int
+    ) -> List[Tuple[int, str, List[T]]]:
+        """Return the keys within max_distance edits of word with their distances and values.
+
+        Walks the trie once, computing the band of the edit distance table for each character,
+        and skips every subtree that can't get within max_distance.
+        """
+        results = []
+        cap = max_distance + 1
+        # the band for the empty key prefix, with columns from -max_distance
+        first_band = [
+            j if 0 <= j <= len(word) else cap for j in range(-max_distance, cap)
+        ]
+        # where the last column of word is in the band of a row, relative to its depth
+        end = len(word) + max_distance
+        stack = [(child, "", first_band) for child in self.root.children.values()]
+        while stack:
+            node, path, band = stack.pop()
+            for depth, char in enumerate(node.label, len(path) + 1):
+                band = next_edit_band(band, char, word, depth, max_distance)
+                if min(band) > max_distance:
+                    break
+            else:
+                path += node.label
+                last = end - len(path)
+                if node.values is not None and 0 <= last < len(band):
+                    if band[last] <= max_distance:
+                        results.append((band[last], path, node.values))
+                stack.extend((child, path, band) for child in node.children.values())
+        return results
+
+    def search_fuzzy(
+        self, word: str, max_distance: int
+    ) -> List[Tuple[int, str, List[T]]]:
+        """Return the closest keys within max_distance edits of word,
+        with their distances and values.
+
+        Each distance is tried in turn, since a smaller one prunes much more of the trie.
+        """
+        for distance in range(1, max_distance + 1):
+            results = self.search_within(word, distance)
+            if results:
+                results.sort(key=lambda result: (result[0], len(result[1]), result[1]))
+                return results
+        return []
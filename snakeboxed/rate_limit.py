@@ -0,0 +1,121 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, NamedTuple, Optional, Tuple
+
+USER = "user"
+CHANNEL = "channel"
+GUILD = "guild"
+# jobs allowed per period in seconds for each scope
+DEFAULT_LIMITS = {
+    USER: {"jobs": 10, "per": 60},
+    CHANNEL: {"jobs": 30, "per": 60},
+    GUILD: {"jobs": 60, "per": 60},
+}
+
+
+class RateLimited(Exception):
+    """Raised when an eval job would go over a rate limit."""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"over the {scope} rate limit for {retry_after:.1f}s")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class BucketLimit(NamedTuple):
+    capacity: float
+    # tokens added per second
+    rate: float
+
+    @property
+    def time_to_fill(self) -> float:
+        return self.capacity / self.rate
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """Token bucket rate limits for each user, channel and guild.
+
+    Each bucket holds up to a limit's number of jobs, allowing short bursts, and refills
+    steadily over its period. A job takes tokens from every bucket it falls in, or from none
+    if any of them is short.
+    Buckets are kept in order of last use, and dropped once they've been idle long enough to
+    refill completely, since a full bucket is the same as a new one.
+    """
+
+    def __init__(self, limits: Dict[str, BucketLimit]):
+        self.limits = limits
+        self.buckets: Dict[str, OrderedDict[Hashable, TokenBucket]] = {
+            scope: OrderedDict() for scope in limits
+        }
+
+    @classmethod
+    def from_config(cls, config: dict) -> "RateLimiter":
+        if not config.get("enabled", True):
+            return cls({})
+        limits = {}
+        for scope, default in DEFAULT_LIMITS.items():
+            limit = config.get(scope, default)
+            if limit.get("jobs", 0) > 0:
+                limits[scope] = BucketLimit(limit["jobs"], limit["jobs"] / limit["per"])
+        return cls(limits)
+
+    def __len__(self) -> int:
+        return sum(len(buckets) for buckets in self.buckets.values())
+
+    def expire(self, now: float):
+        """Drop the buckets that have been idle long enough to be full again."""
+        for scope, buckets in self.buckets.items():
+            time_to_fill = self.limits[scope].time_to_fill
+            while buckets:
+                bucket = next(iter(buckets.values()))
+                if now - bucket.updated < time_to_fill:
+                    break
+                buckets.popitem(last=False)
+
+    def refill(self, scope: str, key: Hashable, now: float) -> TokenBucket:
+        """Return the bucket for a key with the tokens it's gained since it was last used."""
+        limit = self.limits[scope]
+        buckets = self.buckets[scope]
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(limit.capacity, now)
+            buckets[key] = bucket
+        else:
+            bucket.tokens = min(
+                limit.capacity, bucket.tokens + (now - bucket.updated) * limit.rate
+            )
+            bucket.updated = now
+            buckets.move_to_end(key)
+        return bucket
+
+    def acquire(self, keys: Iterable[Tuple[str, Optional[Hashable]]], cost: float = 1):
+        """Take cost tokens from the bucket of each scope and key,
+        or raise RateLimited without taking any if one of them doesn't have enough.
+
+        Scopes without a limit and keys that are None are skipped.
+        A cost bigger than a bucket can hold takes the whole bucket.
+        """
+        now = time.monotonic()
+        self.expire(now)
+
+        taking = []
+        for scope, key in keys:
+            if scope not in self.limits or key is None:
+                continue
+            limit = self.limits[scope]
+            bucket = self.refill(scope, key, now)
+            bucket_cost = min(cost, limit.capacity)
+            if bucket.tokens < bucket_cost:
+                raise RateLimited(scope, (bucket_cost - bucket.tokens) / limit.rate)
+            taking.append((bucket, bucket_cost))
+
+        for bucket, bucket_cost in taking:
+            bucket.tokens -= bucket_cost
@@ -0,0 +1,133 @@
+import asyncio
+import copy
+from typing import Dict, Optional
+
+import discord
+
+REEVAL_EMOJI = "\U0001f501"  # :repeat:
+
+
+class ReevalSession:
+    """An eval command message waiting to be edited and re-evaluated."""
+
+    def __init__(self, message: discord.Message, author_id: int):
+        self.message = message
+        self.message_id = message.id
+        self.author_id = author_id
+        # last seen content, so edits that don't change it are ignored
+        self.content = message.content
+
+        self._edit: Optional[asyncio.Future] = None
+        self._reaction: Optional[asyncio.Future] = None
+        # an edit made while nothing was waiting for one, like while the job was running
+        self.pending_edit: Optional[discord.Message] = None
+        self.closed = False
+
+    async def _wait(self, attribute: str, timeout: float):
+        if self.closed:
+            raise asyncio.TimeoutError()
+        future = asyncio.get_running_loop().create_future()
+        setattr(self, attribute, future)
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        finally:
+            setattr(self, attribute, None)
+
+    async def wait_for_edit(self, timeout: float) -> discord.Message:
+        """Wait for the content of the message to be edited and return the edited message,
+        or return it straight away if it was edited since the last wait.
+
+        Raises asyncio.TimeoutError if it isn't edited in time.
+        """
+        if self.pending_edit is not None and not self.closed:
+            message, self.pending_edit = self.pending_edit, None
+            return message
+        return await self._wait("_edit", timeout)
+
+    async def wait_for_reaction(self, timeout: float):
+        """Wait for the author to add REEVAL_EMOJI to the message.
+
+        Raises asyncio.TimeoutError if they don't react in time.
+        """
+        await self._wait("_reaction", timeout)
+
+    def on_edit(self, payload: discord.RawMessageUpdateEvent) -> bool:
+        """Pass an edit to whatever is waiting for one, or keep it for the next wait.
+
+        Return True if the content changed.
+        """
+        content = payload.data.get("content")
+        # embeds loading also counts as an edit, without new content
+        if content is None or content == self.content:
+            return False
+        self.content = content
+        edited = self.edited_message(content)
+        if self._edit is not None and not self._edit.done():
+            self._edit.set_result(edited)
+        else:
+            self.pending_edit = edited
+        return True
+
+    def edited_message(self, content: str) -> discord.Message:
+        """Return a copy of the message with its new content.
+
+        The raw edit event only has the changed fields, and the rest of the message is the same.
+        """
+        edited = copy.copy(self.message)
+        edited.content = content
+        return edited
+
+    def on_reaction(self, payload: discord.RawReactionActionEvent):
+        if payload.user_id != self.author_id or str(payload.emoji) != REEVAL_EMOJI:
+            return
+        if self._reaction is not None and not self._reaction.done():
+            self._reaction.set_result(None)
+
+    def close(self):
+        """End the session, as if waiting for an edit or reaction timed out."""
+        self.closed = True
+        for future in (self._edit, self._reaction):
+            if future is not None and not future.done():
+                future.set_exception(asyncio.TimeoutError())
+
+
+class ReevalSessions:
+    """Active re-eval sessions by message id.
+
+    Raw gateway events are routed straight to the session for their message,
+    so handling an event costs the same however many sessions there are,
+    and works whether or not the message is in the message cache.
+    """
+
+    def __init__(self):
+        self.sessions: Dict[int, ReevalSession] = {}
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def start(self, message: discord.Message, author_id: int) -> ReevalSession:
+        session = ReevalSession(message, author_id)
+        self.sessions[message.id] = session
+        return session
+
+    def stop(self, session: ReevalSession):
+        if self.sessions.get(session.message_id) is session:
+            del self.sessions[session.message_id]
+
+    def close_all(self):
+        for session in self.sessions.values():
+            session.close()
+
+    def dispatch_edit(
+        self, payload: discord.RawMessageUpdateEvent
+    ) -> Optional[ReevalSession]:
+        """Route an edit to its session and return the session if the content changed."""
+        session = self.sessions.get(payload.message_id)
+        if session is not None and session.on_edit(payload):
+            return session
+        return None
+
+    def dispatch_reaction(self, payload: discord.RawReactionActionEvent):
+        session = self.sessions.get(payload.message_id)
+        if session is not None:
+            session.on_reaction(payload)
@@ -0,0 +1,131 @@
+import asyncio
+import contextlib
+import logging
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Hashable, Optional
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_QUEUE = 100
+
+
+log = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when an eval job can't be queued because the queue is full."""
+
+
+class EvalScheduler:
+    """Limit how many eval jobs run at once, queueing the rest fairly.
+
+    Queued jobs are grouped into lanes, normally one per guild, and lanes take turns.
+    A busy guild only ever delays other guilds by one job per turn.
+    The total number of queued jobs is bounded; past that, jobs are rejected.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+
+        self.running = 0
+        self.queued = 0
+        # lanes in round-robin order, the next lane to get a slot first
+        self.lanes: OrderedDict[Hashable, Deque[asyncio.Future]] = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "EvalScheduler":
+        return cls(
+            max_concurrency=config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY),
+            max_queue=config.get("max_queue", DEFAULT_MAX_QUEUE),
+        )
+
+    def position(self, lane: Hashable, waiter: asyncio.Future) -> int:
+        """Return the 1-based position of a queued job in the overall running order."""
+        index = self.lanes[lane].index(waiter)
+        position = index + 1
+        before = True
+        for other_lane, queue in self.lanes.items():
+            if other_lane == lane:
+                before = False
+                continue
+            # lanes before this one get one more turn in the same round
+            position += min(len(queue), index + 1 if before else index)
+        return position
+
+    async def acquire(
+        self,
+        lane: Hashable,
+        on_queued: Optional[Callable[[int], Awaitable]] = None,
+    ):
+        """Wait for a free slot to run a job in.
+
+        on_queued is awaited with the job's queue position if the job has to wait,
+        the job keeps its place in the queue if it fails.
+        """
+        if self.running < self.max_concurrency and not self.queued:
+            self.running += 1
+            return
+
+        if self.queued >= self.max_queue:
+            raise QueueFull(f"{self.queued} eval jobs are already queued")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.lanes.setdefault(lane, deque()).append(waiter)
+        self.queued += 1
+
+        try:
+            if on_queued is not None:
+                try:
+                    await on_queued(self.position(lane, waiter))
+                except Exception:
+                    log.exception("Couldn't tell a job its queue position")
+            await waiter
+        except BaseException:
+            if not waiter.done() or waiter.cancelled():
+                self._forget(lane, waiter)
+            else:
+                # the slot was handed over just as this job was stopped
+                self.release()
+            raise
+
+    def release(self):
+        """Free a slot, handing it straight to the next queued job if there is one."""
+        while self.lanes:
+            lane, queue = next(iter(self.lanes.items()))
+            waiter = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self.lanes.move_to_end(lane)
+            else:
+                del self.lanes[lane]
+
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.running -= 1
+
+    def _forget(self, lane: Hashable, waiter: asyncio.Future):
+        queue = self.lanes.get(lane)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self.queued -= 1
+        if not queue:
+            del self.lanes[lane]
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self,
+        lane: Hashable,
+        on_queued: Optional[Callable[[int], Awaitable]] = None,
+    ) -> AsyncIterator[None]:
+        await self.acquire(lane, on_queued)
+        try:
+            yield
+        finally:
+            self.release()
@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import random
+from typing import Iterable, List, Optional, Union
+
+import aiohttp
+
+from snakeboxed.circuit_breaker import (
+    DEFAULT_COOLDOWN,
+    DEFAULT_FAILURE_THRESHOLD,
+    CircuitBreaker,
+)
+
+HEALTH_CHECK_INTERVAL = 15
+HEALTH_CHECK_TIMEOUT = 5
+MAX_FAILURES = 3
+
+DEFAULT_CONNECTION_LIMIT = 32
+DEFAULT_KEEPALIVE_TIMEOUT = 60
+DEFAULT_CONNECT_TIMEOUT = 5
+# snekbox kills jobs after a few seconds, so this only trips if snekbox itself hangs
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_RETRIES = 2
+DEFAULT_RETRY_BACKOFF = 0.5
+
+
+log = logging.getLogger(__name__)
+
+
+class SnekboxUnavailable(Exception):
+    """Raised when no snekbox backend could take an eval job."""
+
+    def __init__(self, *args, retry_after: float = 0):
+        super().__init__(*args)
+        self.retry_after = retry_after
+
+
+class SnekboxTimeout(SnekboxUnavailable):
+    """Raised when a snekbox backend took the job but didn't answer in time."""
+
+
+class RequestProgress:
+    """How far a request got, passed to the tracing hooks as its trace_request_ctx."""
+
+    __slots__ = ("headers_sent",)
+
+    def __init__(self):
+        # a request only sends its headers once it has a connection
+        self.headers_sent = False
+
+
+async def on_request_headers_sent(
+    session: aiohttp.ClientSession,
+    context,
+    params: aiohttp.TraceRequestHeadersSentParams,
+):
+    if isinstance(context.trace_request_ctx, RequestProgress):
+        context.trace_request_ctx.headers_sent = True
+
+
+def is_connect_timeout(error: Exception, progress: RequestProgress) -> bool:
+    """Return whether a timeout happened before the request had a connection."""
+    # only aiohttp 3.10 and later tell connect and read timeouts apart themselves
+    connection_timeout_error = getattr(aiohttp, "ConnectionTimeoutError", ())
+    return isinstance(error, connection_timeout_error) or not progress.headers_sent
+
+
+class SnekboxBackend:
+    """A single snekbox server and its load and health state."""
+
+    def __init__(self, url: str, weight: int = 1):
+        if weight < 1:
+            raise ValueError(f"snekbox backend weight must be at least 1, got {weight}")
+
+        self.url = url.rstrip("/")
+        self.eval_url = f"{self.url}/eval"
+        self.weight = weight
+
+        self.outstanding = 0
+        self.failures = 0
+        self.healthy = True
+
+    def __repr__(self) -> str:
+        return (
+            f"<SnekboxBackend url={self.url!r} weight={self.weight} "
+            f"outstanding={self.outstanding} healthy={self.healthy}>"
+        )
+
+    @property
+    def load(self) -> float:
+        """Outstanding requests relative to the weight of this backend."""
+        return self.outstanding / self.weight
+
+    def mark_success(self):
+        if not self.healthy:
+            log.info(f"snekbox backend {self.url} is healthy again")
+        self.failures = 0
+        self.healthy = True
+
+    def mark_failure(self, max_failures: int = MAX_FAILURES):
+        self.failures += 1
+        if self.healthy and self.failures >= max_failures:
+            log.warning(
+                f"snekbox backend {self.url} failed {self.failures} times in a row, "
+                "taking it out of rotation"
+            )
+            self.healthy = False
+
+
+class SnekboxPool:
+    """Spread eval jobs over one or more snekbox backends.
+
+    Jobs go to the healthy backend with the least outstanding requests for its weight.
+    Backends are health checked in the background and taken out of rotation after
+    several failures in a row. A job that hits a connection error fails over to the next backend,
+    and if every backend fails the job is retried a few times with jittered backoff.
+    Jobs that time out aren't retried, since snekbox may still be running them.
+    Once jobs keep failing, a circuit breaker fails new jobs fast until snekbox recovers.
+
+    Uses its own HTTP session, with a pool of keep-alive connections to the backends.
+    """
+
+    def __init__(
+        self,
+        backends: Iterable[SnekboxBackend],
+        health_check_interval: float = HEALTH_CHECK_INTERVAL,
+        max_failures: int = MAX_FAILURES,
+        connection_limit: int = DEFAULT_CONNECTION_LIMIT,
+        keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        retries: int = DEFAULT_RETRIES,
+        retry_backoff: float = DEFAULT_RETRY_BACKOFF,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.backends: List[SnekboxBackend] = list(backends)
+        if not self.backends:
+            raise ValueError("at least one snekbox backend is required")
+
+        self.health_check_interval = health_check_interval
+        self.max_failures = max_failures
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(
+            total=connect_timeout + read_timeout,
+            connect=connect_timeout,
+            sock_read=read_timeout,
+        )
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+
+        # assigned in start for async
+        self.http_session: Optional[aiohttp.ClientSession] = None
+        self._health_check_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_config(
+        cls, snekbox_url: Union[str, list], config: Optional[dict] = None
+    ) -> "SnekboxPool":
+        """Create a pool from the snekbox_url setting and the [snekbox] config section.
+
+        The setting is either a single URL or a list of URLs and {url, weight} tables.
+        """
+        config = config or {}
+        if isinstance(snekbox_url, str):
+            snekbox_url = [snekbox_url]
+
+        backends = []
+        for entry in snekbox_url:
+            if isinstance(entry, str):
+                backends.append(SnekboxBackend(entry))
+            else:
+                backends.append(SnekboxBackend(entry["url"], entry.get("weight", 1)))
+
+        circuit_breaker = CircuitBreaker(
+            failure_threshold=config.get("breaker_failures", DEFAULT_FAILURE_THRESHOLD),
+            cooldown=config.get("breaker_cooldown", DEFAULT_COOLDOWN),
+        )
+        return cls(
+            backends,
+            connection_limit=config.get("connection_limit", DEFAULT_CONNECTION_LIMIT),
+            keepalive_timeout=config.get(
+                "keepalive_timeout", DEFAULT_KEEPALIVE_TIMEOUT
+            ),
+            connect_timeout=config.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+            read_timeout=config.get("read_timeout", DEFAULT_READ_TIMEOUT),
+            retries=config.get("retries", DEFAULT_RETRIES),
+            retry_backoff=config.get("retry_backoff", DEFAULT_RETRY_BACKOFF),
+            circuit_breaker=circuit_breaker,
+        )
+
+    def start(self):
+        """Open the HTTP session and start health checking the backends."""
+        connector = aiohttp.TCPConnector(
+            limit=self.connection_limit, keepalive_timeout=self.keepalive_timeout
+        )
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_headers_sent.append(on_request_headers_sent)
+        self.http_session = aiohttp.ClientSession(
+            connector=connector, timeout=self.timeout, trace_configs=[trace_config]
+        )
+        # a single backend has nowhere to fail over to, so it's always used
+        if len(self.backends) > 1:
+            self._health_check_task = asyncio.create_task(self.health_check_loop())
+
+    async def close(self):
+        if self._health_check_task is not None:
+            self._health_check_task.cancel()
+            self._health_check_task = None
+        if self.http_session is not None:
+            await self.http_session.close()
+            self.http_session = None
+
+    def choose_backends(self) -> List[SnekboxBackend]:
+        """Return the backends in the order they should be tried for the next job.
+
+        Healthy backends come first, least loaded first.
+        Unhealthy backends are kept at the end as a last resort.
+        """
+        return sorted(self.backends, key=lambda b: (not b.healthy, b.load, -b.weight))
+
+    async def post_eval(
+        self,
+        code: str,
+        files: Optional[List[dict]] = None,
+        deadline: Optional[float] = None,
+    ) -> dict:
+        """Send code to a snekbox backend for evaluation and return the results.
+
+        files are written next to the code before it runs, in the format of the snekbox API.
+        Jobs aren't retried if the retry would start after the deadline, in event loop time.
+        """
+        if not self.circuit_breaker.allow():
+            raise SnekboxUnavailable(
+                "snekbox is down, not sending the job",
+                retry_after=self.circuit_breaker.retry_after,
+            )
+
+        try:
+            if files:
+                data = {"args": ["-c", code], "files": files}
+            else:
+                data = {"input": code}
+            results = await self.post_eval_with_retries(data, deadline)
+        except SnekboxUnavailable:
+            self.circuit_breaker.record_failure()
+            raise
+        except BaseException:
+            self.circuit_breaker.release()
+            raise
+
+        self.circuit_breaker.record_success()
+        return results
+
+    def retry_delay(self, attempt: int) -> float:
+        """Return the delay before a retry, with full jitter so retries don't come in waves."""
+        return random.uniform(0, self.retry_backoff * 2 ** (attempt - 1))
+
+    async def post_eval_with_retries(
+        self, data: dict, deadline: Optional[float] = None
+    ) -> dict:
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.retry_delay(attempt)
+                now = asyncio.get_running_loop().time()
+                if deadline is not None and now + delay >= deadline:
+                    log.warning("Not retrying an eval job that would pass its deadline")
+                    raise last_error
+                await asyncio.sleep(delay)
+            try:
+                return await self.post_eval_with_failover(data)
+            except SnekboxTimeout:
+                raise
+            except SnekboxUnavailable as error:
+                last_error = error
+
+        log.warning(f"Gave up on an eval job after {self.retries + 1} attempts")
+        raise last_error
+
+    async def post_eval_with_failover(self, data: dict) -> dict:
+        last_error = None
+
+        for backend in self.choose_backends():
+            backend.outstanding += 1
+            progress = RequestProgress()
+            try:
+                async with self.http_session.post(
+                    backend.eval_url,
+                    json=data,
+                    raise_for_status=True,
+                    trace_request_ctx=progress,
+                ) as resp:
+                    results = await resp.json()
+            except asyncio.TimeoutError as error:
+                backend.mark_failure(self.max_failures)
+                if not is_connect_timeout(error, progress):
+                    log.warning(f"snekbox backend {backend.url} timed out")
+                    raise SnekboxTimeout(f"{backend.url} timed out") from error
+                log.warning(f"Connection to snekbox backend {backend.url} timed out")
+                last_error = error
+                continue
+            except aiohttp.ClientConnectionError as error:
+                log.warning(
+                    f"Connection to snekbox backend {backend.url} failed: {error}"
+                )
+                backend.mark_failure(self.max_failures)
+                last_error = error
+                continue
+            finally:
+                backend.outstanding -= 1
+
+            backend.mark_success()
+            return results
+
+        raise SnekboxUnavailable("No snekbox backend is reachable") from last_error
+
+    async def check_health(self, backend: SnekboxBackend):
+        """Check that the backend's HTTP server answers.
+
+        Any response short of a server error counts as healthy.
+        """
+        timeout = aiohttp.ClientTimeout(total=HEALTH_CHECK_TIMEOUT)
+        try:
+            async with self.http_session.get(backend.url, timeout=timeout) as resp:
+                healthy = resp.status < 500
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+
+        if healthy:
+            backend.mark_success()
+        else:
+            backend.mark_failure(self.max_failures)
+
+    async def health_check_loop(self):
+        while True:
+            await asyncio.gather(*(self.check_health(b) for b in self.backends))
+            await asyncio.sleep(self.health_check_interval)
@@ -0,0 +1,108 @@
+import contextlib
+import logging
+import re
+import subprocess
+import sys
+import time
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+# the line format of python -X importtime, in microseconds
+IMPORT_TIME_REGEX = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+TOP_IMPORTS = 15
+
+log = logging.getLogger(__name__)
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_seconds: float
+    cumulative_seconds: float
+    depth: int
+
+
+def profile_imports(modules: Iterable[str]) -> List[ImportTime]:
+    """Import the modules in a fresh interpreter with -X importtime and return how long each took.
+
+    A fresh interpreter is used so modules this process has already imported are still counted.
+    """
+    code = "\n".join(f"import {module}" for module in modules)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    import_times = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_REGEX.match(line)
+        if match is not None:
+            self_us, cumulative_us, indent, module = match.groups()
+            import_times.append(
+                ImportTime(
+                    module,
+                    int(self_us) / 1e6,
+                    int(cumulative_us) / 1e6,
+                    len(indent) // 2,
+                )
+            )
+    return import_times
+
+
+class StartupProfile:
+    """Time each step of starting the bot, reported once it's ready.
+
+    Steps are timed from when the profile was created, which should be as early as possible.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sections: List[Tuple[str, float]] = []
+        self.import_times: List[ImportTime] = []
+
+    @contextlib.contextmanager
+    def section(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sections.append((name, time.perf_counter() - start))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def profile_imports(self, modules: Iterable[str]):
+        self.import_times = profile_imports(modules)
+
+    def report(self, elapsed: float, name: str = "ready"):
+        """Log the time taken by each import and section, and the elapsed time to name."""
+        if self.import_times:
+            top_level = [t for t in self.import_times if t.depth == 0]
+            log.info(
+                f"Imports in a fresh interpreter took "
+                f"{sum(t.cumulative_seconds for t in top_level):.3f}s, the slowest were:"
+            )
+            slowest = sorted(
+                self.import_times, key=lambda t: t.cumulative_seconds, reverse=True
+            )
+            for import_time in slowest[:TOP_IMPORTS]:
+                log.info(
+                    f"  {import_time.module}: {import_time.cumulative_seconds:.3f}s "
+                    f"({import_time.self_seconds:.3f}s in the module itself)"
+                )
+            log.info("Snakeboxed modules:")
+            for import_time in self.import_times:
+                if import_time.module.startswith("snakeboxed"):
+                    log.info(
+                        f"  {import_time.module}: {import_time.cumulative_seconds:.3f}s"
+                    )
+
+        log.info("Startup steps:")
+        for section, seconds in self.sections:
+            log.info(f"  {section}: {seconds:.3f}s")
+        log.info(f"{elapsed:.3f}s from start to {name}")
+
+
+def maybe_section(profile: Optional[StartupProfile], name: str):
+    """Time a section if startup is being profiled."""
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.section(name)
@@ -0,0 +1,150 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import time
+import uuid
+from pathlib import Path
+from typing import Iterator, Optional
+
+DEFAULT_TRACE_PATH = Path("traces.jsonl")
+DEFAULT_MAX_BYTES = 10 * (10**6)  # 10MB
+DEFAULT_BACKUP_COUNT = 3
+DEFAULT_QUEUE_SIZE = 10_000
+DEFAULT_SAMPLE_RATE = 1.0
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes")
+
+    def __init__(
+        self, trace_id: str, parent_id: Optional[str], name: str, attributes: dict
+    ):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+
+
+# the span that new spans are children of, followed across awaits and into new tasks
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format span records, whose message is a dict, as one line of JSON each."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, default=str)
+
+
+class Tracer:
+    """Record timed spans for the stages of each eval job, grouped into traces.
+
+    A trace is started for each job, and spans started while it's running are its children,
+    including spans in tasks it starts. Outside a trace, or when tracing is off,
+    starting a span costs one context variable lookup.
+    Finished spans are queued as they are, then serialised and written to the trace file
+    by a background thread, and dropped if the queue is full.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = DEFAULT_SAMPLE_RATE
+        self.queue: Optional[queue.Queue] = None
+        self.dropped = 0
+
+    @contextlib.contextmanager
+    def trace(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """Start a new trace, with a root span covering the body of the with statement,
+        if tracing is on and the trace is sampled.
+        """
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield None
+            return
+        with self._span(uuid.uuid4().hex, None, name, attributes) as span:
+            yield span
+
+    def span(self, name: str, **attributes):
+        """Time the body of the with statement as a child of the current span, if there is one."""
+        parent = _current_span.get()
+        if parent is None:
+            return contextlib.nullcontext()
+        return self._span(parent.trace_id, parent.span_id, name, attributes)
+
+    @contextlib.contextmanager
+    def _span(
+        self, trace_id: str, parent_id: Optional[str], name: str, attributes: dict
+    ) -> Iterator[Span]:
+        span = Span(trace_id, parent_id, name, attributes)
+        token = _current_span.set(span)
+        start_time = time.time()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield span
+        except BaseException as exception:
+            error = type(exception).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            _current_span.reset(token)
+            self.export(
+                {
+                    "trace_id": span.trace_id,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "name": span.name,
+                    "start": start_time,
+                    "duration": duration,
+                    "attributes": span.attributes,
+                    "error": error,
+                }
+            )
+
+    def export(self, span_dict: dict):
+        # records are made directly, so the spans don't depend on how logging is configured
+        try:
+            self.queue.put_nowait(logging.makeLogRecord({"msg": span_dict}))
+        except queue.Full:
+            self.dropped += 1
+
+
+TRACER = Tracer()
+
+
+def span(name: str, **attributes):
+    return TRACER.span(name, **attributes)
+
+
+def setup_tracing(config: dict, trace_path: Optional[Path] = None):
+    """Write spans to a rotating JSON lines file from a background thread.
+
+    Set up from the [tracing] config section, tracing stays off unless it's enabled there.
+    """
+    if not config.get("enabled", False):
+        return
+    if trace_path is None:
+        trace_path = Path(config.get("path", DEFAULT_TRACE_PATH))
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        trace_path,
+        maxBytes=config.get("max_bytes", DEFAULT_MAX_BYTES),
+        backupCount=config.get("backup_count", DEFAULT_BACKUP_COUNT),
+        encoding="utf_8",
+    )
+    file_handler.setFormatter(JsonLinesFormatter())
+
+    TRACER.queue = queue.Queue(maxsize=config.get("queue_size", DEFAULT_QUEUE_SIZE))
+    listener = logging.handlers.QueueListener(TRACER.queue, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    TRACER.sample_rate = config.get("sample_rate", DEFAULT_SAMPLE_RATE)
+    TRACER.enabled = True